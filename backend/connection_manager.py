@@ -0,0 +1,152 @@
+"""
+Topic-based WebSocket fan-out. Every connection gets a bounded send queue
+drained by its own task, so one slow client never delays the others; a
+client whose queue fills up is disconnected. Messages are serialized once
+per publish and the same text frame is reused for every recipient.
+"""
+import asyncio
+import json
+import math
+from typing import Iterable, Optional
+
+from fastapi import WebSocket
+
+GLOBAL_TOPIC = "global"
+ADMIN_TOPIC = "admin"
+SEND_QUEUE_SIZE = 256
+SEND_TIMEOUT_SECONDS = 10.0
+# Admin zones are cells of this many degrees (~5.5 km) on a lat/lng grid
+ZONE_CELL_DEG = 0.05
+
+def rider_topic(rider_id: int) -> str:
+    return f"rider:{rider_id}"
+
+def zone_topic(lat: float, lng: float) -> str:
+    return f"zone:{math.floor(lat / ZONE_CELL_DEG)}:{math.floor(lng / ZONE_CELL_DEG)}"
+
+class Subscriber:
+    """One WebSocket with its topics, bounded outbound queue and sender task"""
+    def __init__(self, websocket: WebSocket, queue_size: int = SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.topics = set()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+
+class ConnectionManager:
+    def __init__(self, queue_size: int = SEND_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = {}  # websocket -> Subscriber
+        self.topics = {}       # topic -> set of Subscriber
+
+    @property
+    def active_connections(self):
+        return list(self.subscribers)
+
+    async def connect(self, websocket: WebSocket, topics: Iterable[str] = (GLOBAL_TOPIC,)):
+        await websocket.accept()
+        subscriber = Subscriber(websocket, self.queue_size)
+        self.subscribers[websocket] = subscriber
+        self.subscribe(websocket, topics)
+        subscriber.task = asyncio.create_task(self._sender(subscriber))
+        return subscriber
+
+    def disconnect(self, websocket: WebSocket):
+        subscriber = self.subscribers.pop(websocket, None)
+        if subscriber is None:
+            return
+        for topic in subscriber.topics:
+            members = self.topics.get(topic)
+            if members is not None:
+                members.discard(subscriber)
+                if not members:
+                    del self.topics[topic]
+        if subscriber.task is not None and subscriber.task is not asyncio.current_task():
+            subscriber.task.cancel()
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        subscriber = self.subscribers.get(websocket)
+        if subscriber is None:
+            return
+        for topic in topics:
+            subscriber.topics.add(topic)
+            self.topics.setdefault(topic, set()).add(subscriber)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        subscriber = self.subscribers.get(websocket)
+        if subscriber is None:
+            return
+        for topic in topics:
+            subscriber.topics.discard(topic)
+            members = self.topics.get(topic)
+            if members is not None:
+                members.discard(subscriber)
+                if not members:
+                    del self.topics[topic]
+
+    async def _sender(self, subscriber: Subscriber):
+        websocket = subscriber.websocket
+        try:
+            while True:
+                text = await subscriber.queue.get()
+                await asyncio.wait_for(websocket.send_text(text), SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Dropping WebSocket client after send failure: {e}")
+            self.disconnect(websocket)
+
+    def _drop_slow(self, subscriber: Subscriber):
+        """Disconnect a client that fell a full queue behind"""
+        print("Dropping slow WebSocket consumer")
+        websocket = subscriber.websocket
+        self.disconnect(websocket)
+        # 1013: try again later
+        asyncio.ensure_future(self._close_quietly(websocket, 1013))
+
+    async def _close_quietly(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def publish(self, message: dict, topics: Iterable[str] = (GLOBAL_TOPIC,)) -> int:
+        """
+        Queue message for every subscriber of any of topics (each recipient once).
+        Never waits on a client. Returns the number of recipients.
+        """
+        recipients = set()
+        for topic in topics:
+            recipients.update(self.topics.get(topic, ()))
+        if not recipients:
+            return 0
+        text = json.dumps(message, default=str)
+        for subscriber in recipients:
+            try:
+                subscriber.queue.put_nowait(text)
+            except asyncio.QueueFull:
+                self._drop_slow(subscriber)
+        return len(recipients)
+
+    async def send(self, websocket: WebSocket, message: dict):
+        """Queue a message for a single connection"""
+        subscriber = self.subscribers.get(websocket)
+        if subscriber is None:
+            return
+        try:
+            subscriber.queue.put_nowait(json.dumps(message, default=str))
+        except asyncio.QueueFull:
+            self._drop_slow(subscriber)
+
+    async def broadcast(self, message: dict):
+        await self.publish(message, (GLOBAL_TOPIC,))
+
+    async def publish_rider(self, rider_id: Optional[int], message: dict, lat: float = None, lng: float = None):
+        """Message about one rider: to that rider, admins, and the zone the rider is in"""
+        topics = [ADMIN_TOPIC]
+        if rider_id is not None:
+            topics.append(rider_topic(rider_id))
+        if lat is not None and lng is not None:
+            topics.append(zone_topic(lat, lng))
+        await self.publish(message, topics)
+
+manager = ConnectionManager()
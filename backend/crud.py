@@ -1,5 +1,6 @@
 from sqlalchemy.orm import Session
 import models, schemas, auth
+from order_stats import stats
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -32,11 +33,13 @@ def create_order(db: Session, order: schemas.OrderCreate):
     db.add(db_order)
     db.commit()
     db.refresh(db_order)
+    stats.transition(None, db_order.status, None, db_order.rider_id)
     return db_order
 
 def update_order_status(db: Session, order_id: int, status: str):
     db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
     if db_order:
+        old_status, rider_id = db_order.status, db_order.rider_id
         if status == models.OrderStatus.DELIVERED:
             db.delete(db_order)
         else:
@@ -44,15 +47,19 @@ def update_order_status(db: Session, order_id: int, status: str):
         db.commit()
         if status != models.OrderStatus.DELIVERED:
             db.refresh(db_order)
+        # Delivered orders are removed from the table
+        stats.transition(old_status, None if status == models.OrderStatus.DELIVERED else status, rider_id, rider_id)
     return db_order
 
 def assign_order_to_rider(db: Session, order_id: int, rider_id: int):
     db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
     if db_order:
+        old_status, old_rider_id = db_order.status, db_order.rider_id
         db_order.rider_id = rider_id
         db_order.status = models.OrderStatus.ASSIGNED
         db.commit()
         db.refresh(db_order)
+        stats.transition(old_status, models.OrderStatus.ASSIGNED, old_rider_id, rider_id)
     return db_order
 
 def get_available_orders(db: Session):
@@ -69,3 +76,7 @@ def update_rider_location(db: Session, rider_id: int, lat: float, lng: float):
         db.commit()
         db.refresh(db_rider)
     return db_rider
+
+def get_route(db: Session, rider_id: int):
+    return db.query(models.Route).filter(models.Route.rider_id == rider_id).first()
+
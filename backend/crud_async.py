@@ -0,0 +1,102 @@
+"""
+AsyncSession counterparts of the crud functions used by async def endpoints.
+"""
+import json
+from typing import Optional
+
+from sqlalchemy import and_, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models, schemas, routing
+from order_stats import stats
+from database import IS_SQLITE
+
+def orders_in_bbox(min_lat: float, min_lng: float, max_lat: float, max_lng: float):
+    """Order filter for a lat/lng box, written so the location index can serve it"""
+    if IS_SQLITE:
+        return and_(models.Order.lat.between(min_lat, max_lat), models.Order.lng.between(min_lng, max_lng))
+    # Matches the GiST index on point(lng, lat)
+    return func.point(models.Order.lng, models.Order.lat).op("<@")(
+        func.box(func.point(min_lng, min_lat), func.point(max_lng, max_lat))
+    )
+
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).filter(models.User.email == email))
+    return result.scalars().first()
+
+async def get_order(db: AsyncSession, order_id: int):
+    return await db.get(models.Order, order_id)
+
+async def create_order(db: AsyncSession, order: schemas.OrderCreate):
+    db_order = models.Order(**order.dict())
+    db.add(db_order)
+    await db.commit()
+    await db.refresh(db_order)
+    stats.transition(None, db_order.status, None, db_order.rider_id)
+    return db_order
+
+async def update_order_status(db: AsyncSession, order_id: int, status: str):
+    db_order = await get_order(db, order_id)
+    if db_order:
+        old_status, rider_id = db_order.status, db_order.rider_id
+        if status == models.OrderStatus.DELIVERED:
+            await db.delete(db_order)
+        else:
+            db_order.status = status
+        await db.commit()
+        if status != models.OrderStatus.DELIVERED:
+            await db.refresh(db_order)
+        # Delivered orders are removed from the table
+        stats.transition(old_status, None if status == models.OrderStatus.DELIVERED else status, rider_id, rider_id)
+    return db_order
+
+async def assign_order_to_rider(db: AsyncSession, order_id: int, rider_id: int):
+    db_order = await get_order(db, order_id)
+    if db_order:
+        old_status, old_rider_id = db_order.status, db_order.rider_id
+        db_order.rider_id = rider_id
+        db_order.status = models.OrderStatus.ASSIGNED
+        await db.commit()
+        await db.refresh(db_order)
+        stats.transition(old_status, models.OrderStatus.ASSIGNED, old_rider_id, rider_id)
+    return db_order
+
+async def delete_order(db: AsyncSession, db_order: models.Order):
+    old_status, rider_id = db_order.status, db_order.rider_id
+    await db.delete(db_order)
+    await db.commit()
+    stats.transition(old_status, None, rider_id)
+
+def orders_page_query(criteria: list, after_id: Optional[int] = None, limit: int = 100):
+    """The select list_orders runs"""
+    query = select(models.Order).filter(*criteria)
+    if after_id is not None:
+        query = query.filter(models.Order.id > after_id)
+    return query.order_by(models.Order.id).limit(limit)
+
+async def list_orders(db: AsyncSession, criteria: list, after_id: Optional[int] = None, limit: int = 100):
+    """One keyset page of orders matching criteria, in id order, starting after after_id"""
+    result = await db.execute(orders_page_query(criteria, after_id, limit))
+    return result.scalars().all()
+
+async def get_route(db: AsyncSession, rider_id: int):
+    result = await db.execute(select(models.Route).filter(models.Route.rider_id == rider_id))
+    return result.scalars().first()
+
+async def save_route(db: AsyncSession, rider_id: int, route_data: dict, order_ids: list, fingerprint: str):
+    db_route = await get_route(db, rider_id)
+    if db_route is None:
+        db_route = models.Route(rider_id=rider_id)
+        db.add(db_route)
+    db_route.encoded_polyline = routing.encode_polyline(route_data["points"]["coordinates"])
+    db_route.total_distance = route_data.get("distance")
+    db_route.total_time = route_data.get("time")
+    db_route.order_sequence = json.dumps(order_ids)
+    db_route.waypoints = json.dumps([list(p) for p in route_data.get("ordered_points", [])])
+    db_route.fingerprint = fingerprint
+    await db.commit()
+    await db.refresh(db_route)
+    return db_route
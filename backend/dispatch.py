@@ -0,0 +1,98 @@
+"""
+Batch dispatch of pending orders to riders. Riders go into a spatial grid,
+every order gets its k nearest riders as candidates, and order-rider pairs
+are then awarded cheapest first (higher priority orders bid first) while a
+rider still has capacity and can reach the order inside its delivery window.
+Orders left over are retried against a wider radius with only the riders
+that still have room.
+"""
+import time
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+import routing
+from planning import OrderArrays
+from spatial import GridIndex
+
+DISPATCH_CANDIDATES = 8
+DISPATCH_RADIUS_KM = 5.0
+DISPATCH_ROUNDS = 3
+
+def assign_orders(orders, riders: list, k: int = DISPATCH_CANDIDATES, radius_km: float = DISPATCH_RADIUS_KM,
+                  force: bool = False, plan_start: Optional[datetime] = None,
+                  speed_kmph: float = routing.AVERAGE_SPEED_KMPH,
+                  service_time_min: float = routing.SERVICE_TIME_MIN) -> dict:
+    """
+    orders: planning.OrderArrays, or dicts with id, lat, lng and optional weight,
+    priority, delivery_time_end.
+    riders: dicts with id, lat, lng, capacity and load (weight already on board).
+    Returns {"assignments": {order_id: rider_id}, "unassigned": [order_id], "solve_time"}.
+    With force=True, orders nobody can take go to their nearest rider regardless of
+    capacity and windows.
+    """
+    started = time.perf_counter()
+    plan_start = plan_start or datetime.utcnow()
+    assignments = {}
+    if not isinstance(orders, OrderArrays):
+        orders = OrderArrays.from_records(orders)
+    if not len(orders) or not riders:
+        return {"assignments": assignments, "unassigned": orders.ids.tolist(), "solve_time": 0.0}
+
+    coords, weight, priority, due = orders.coords, orders.weight, orders.priority, orders.due(plan_start)
+    order_ids = orders.ids.tolist()
+    rider_coords = np.array([(r['lat'], r['lng']) for r in riders], dtype=np.float64)
+    remaining = np.array([(r.get('capacity') or 10.0) - (r.get('load') or 0.0) for r in riders], dtype=np.float64)
+    minutes_per_km = 60.0 / speed_kmph
+
+    open_orders = np.arange(len(orders))
+    search_radius = radius_km
+    for round_no in range(DISPATCH_ROUNDS):
+        if not len(open_orders):
+            break
+        # Only riders with room for the lightest open order take part in this round
+        active = np.flatnonzero(remaining >= weight[open_orders].min())
+        if not len(active):
+            break
+        index = GridIndex(rider_coords[active], cell_km=max(radius_km / 2, 0.5))
+        last_round = round_no == DISPATCH_ROUNDS - 1
+        idx, dist = index.nearest_many(coords[open_orders], k, None if last_round else search_radius)
+
+        # Candidate edges (order, rider, km) that are feasible on their own
+        rows, slots = np.nonzero(idx >= 0)
+        o_idx = open_orders[rows]
+        r_idx = active[idx[rows, slots]]
+        km = dist[rows, slots]
+        arrival = km * minutes_per_km + service_time_min
+        ok = (arrival <= due[o_idx]) & (weight[o_idx] <= remaining[r_idx])
+        o_idx, r_idx, km = o_idx[ok], r_idx[ok], km[ok]
+
+        # Award cheapest first, higher priority orders ahead of lower ones
+        taken = np.zeros(len(orders), dtype=bool)
+        for e in np.lexsort((km, -priority[o_idx])):
+            oi = o_idx[e]
+            if taken[oi]:
+                continue
+            ri = r_idx[e]
+            if weight[oi] > remaining[ri]:
+                continue
+            taken[oi] = True
+            remaining[ri] -= weight[oi]
+            assignments[order_ids[oi]] = riders[ri]['id']
+
+        open_orders = open_orders[~taken[open_orders]]
+        search_radius *= 4
+
+    if force and len(open_orders):
+        nearest = GridIndex(rider_coords).nearest_many(coords[open_orders], 1)[0][:, 0]
+        for oi, ri in zip(open_orders, nearest):
+            assignments[order_ids[oi]] = riders[ri]['id']
+            remaining[ri] -= weight[oi]
+        open_orders = open_orders[:0]
+
+    return {
+        "assignments": assignments,
+        "unassigned": [order_ids[oi] for oi in open_orders],
+        "solve_time": time.perf_counter() - started,
+    }
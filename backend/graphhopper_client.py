@@ -0,0 +1,158 @@
+"""
+Shared GraphHopper HTTP client: pooled keep-alive connections, per-request
+timeouts, a cap on in-flight requests and a circuit breaker that fails fast
+while the server is down so callers drop straight to their fallback.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+GRAPHHOPPER_TIMEOUT = float(os.getenv("GRAPHHOPPER_TIMEOUT", "5.0"))
+GRAPHHOPPER_MAX_CONCURRENCY = int(os.getenv("GRAPHHOPPER_MAX_CONCURRENCY", "16"))
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+
+class GraphHopperUnavailable(Exception):
+    """Raised instead of calling GraphHopper while the circuit is open"""
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures. While open every call is
+    rejected; after reset_seconds one probe call is let through (half-open) and
+    its outcome closes or re-opens the circuit.
+    """
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release_probe(self):
+        """Give up a half-open probe without an outcome (the call was cancelled)"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+breaker = CircuitBreaker()
+
+class GraphHopperClient:
+    """Async client for the asyncio endpoints, plus a pooled sync session for thread-pool code"""
+    def __init__(self, timeout: float = GRAPHHOPPER_TIMEOUT, max_concurrency: int = GRAPHHOPPER_MAX_CONCURRENCY,
+                 circuit: CircuitBreaker = breaker):
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.breaker = circuit
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._sync_slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _async_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _record(self, status_code: int):
+        # 4xx means GraphHopper answered (e.g. point out of bounds): the server is healthy
+        if status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send one request, honouring the breaker and the in-flight limit"""
+        client = self._async_client()
+        try:
+            # Shed load instead of queueing forever behind a slow server
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise GraphHopperUnavailable("Too many GraphHopper requests in flight")
+        try:
+            if not self.breaker.allow():
+                raise GraphHopperUnavailable("GraphHopper circuit is open")
+            response = await client.request(method, url, **kwargs)
+        except GraphHopperUnavailable:
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled mid-call: says nothing about the server, but must not hold the probe slot
+            self.breaker.release_probe()
+            raise
+        finally:
+            self._semaphore.release()
+        self._record(response.status_code)
+        return response
+
+    def request_sync(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Blocking variant of request() for code already running in a worker thread"""
+        if not self.breaker.allow():
+            raise GraphHopperUnavailable("GraphHopper circuit is open")
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            with self._sync_slots:
+                response = self.session.request(method, url, **kwargs)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+        self._record(response.status_code)
+        return response
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self.session.close()
+
+client = GraphHopperClient()
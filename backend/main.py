@@ -1,12 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Header, Response, Query, Request
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy import case, select, update
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
 from jose import JWTError, jwt
-import models, schemas, crud, routing, auth
-from database import SessionLocal, engine
+import models, schemas, crud, crud_async, routing, dispatch, auth, road_matrix, route_cache, route_editor, route_jobs, solver_pool, planning, connection_manager
+from connection_manager import manager
+import telemetry
+import order_stats
+import order_ingest
+import traffic
+from graphhopper_client import client as graphhopper
+from database import SessionLocal, AsyncSessionLocal, engine, get_async_db
+import asyncio
 import json
+import threading
+from datetime import datetime
+from collections import Counter
+import time
 
 models.Base.metadata.create_all(bind=engine)
 
@@ -19,10 +33,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Route-Job", "X-Next-Cursor"],
 )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Anytime /optimize: cap on the improvement budget and on how often improvements are pushed
+ANYTIME_MAX_BUDGET_SECONDS = 30.0
+ANYTIME_PUBLISH_INTERVAL_SECONDS = 0.5
+ORDER_PAGE_MAX = 1000
+# Orders per assignment UPDATE; keeps the CASE and IN lists under the drivers' bind-parameter limits
+ASSIGN_CHUNK_ROWS = 1000
+EXPORT_BATCH_ROWS = 1000
+EXPORT_COLUMNS = ["id", "customer_name", "delivery_address", "lat", "lng", "status", "created_at", "rider_id",
+                  "priority", "weight", "delivery_time_start", "delivery_time_end"]
+
+@app.on_event("startup")
+async def startup():
+    telemetry.start(manager)
+    route_jobs.queue.start(manager)
+    route_jobs.anytime_queue.start(manager)
+    order_stats.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await route_jobs.anytime_queue.stop()
+    await route_jobs.queue.stop()
+    await telemetry.stop()
+    await order_stats.stop()
+    road_matrix.matrix_cache.save(force=True)
+    solver_pool.shutdown()
+    await graphhopper.aclose()
+
 def get_db():
     db = SessionLocal()
     try:
@@ -30,7 +72,7 @@ def get_db():
     finally:
         db.close()
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -44,11 +86,261 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_email(db, email=token_data.email)
+    user = await crud_async.get_user_by_email(db, email=token_data.email)
     if user is None:
         raise credentials_exception
     return user
 
+def route_order_ids(route_data: dict, orders_data: list) -> list:
+    """Order ids in visiting order for a computed route"""
+    order_ids = route_data.get("order_ids")
+    if order_ids is not None:
+        return order_ids
+    # Map the solver's point order back onto order ids
+    by_point = {}
+    for o in orders_data:
+        by_point.setdefault((o['lat'], o['lng']), []).append(o['id'])
+    order_ids = []
+    for p in route_data.get("ordered_points", []):
+        ids = by_point.get(tuple(p))
+        if ids:
+            order_ids.append(ids.pop(0))
+    return order_ids
+
+def route_etag(key: str, route_data: dict) -> str:
+    """Quoted ETag for a route: the input key, plus the revision once anytime search improved it"""
+    revision = route_data.get("revision") if route_data else None
+    return f'"{key}-{revision}"' if revision else f'"{key}"'
+
+async def persist_route(db: AsyncSession, rider, route_data: dict, orders_data: list, fingerprint: str = None,
+                        position: Optional[tuple] = None):
+    """
+    Store the latest computed route for a rider so it can be served without
+    recomputation. Fallback routes are not stored: GraphHopper's replaces them.
+    """
+    if not route_data or not route_data.get("points") or routing.is_degraded(route_data):
+        return None
+    order_ids = route_order_ids(route_data, orders_data)
+    if fingerprint is None:
+        lat, lng = position or (rider.current_lat, rider.current_lng)
+        fingerprint = route_cache.route_key(rider.id, orders_data, lat, lng, capacity=rider.capacity or 10.0)
+    try:
+        return await crud_async.save_route(db, rider.id, route_data, order_ids, fingerprint)
+    except Exception as e:
+        await db.rollback()
+        print(f"Error persisting route for rider {rider.id}: {e}")
+        return None
+
+async def reroute_rider(rider_id: int):
+    """Bring a rider's route in line with their active orders, store and publish it"""
+    async with AsyncSessionLocal() as db:
+        plan_input = await planning.load_plan_input(db, [rider_id])
+        rider = plan_input.rider(rider_id)
+        if rider is None:
+            return None
+        orders_data = plan_input.orders_of(rider_id)
+
+        # Live position: the telemetry store is ahead of users.current_lat/lng by up to one flush interval
+        start = plan_input.position(rider_id)
+        if not orders_data or (start is None and len(orders_data) < 2):
+            route_editor.editor.forget(rider_id)
+            return None
+
+        rider_capacity = rider.capacity or 10.0
+        route_data = await route_editor.editor.update(rider_id, start, orders_data, rider_capacity)
+        await persist_route(db, rider, route_data, orders_data, position=start)
+
+    await manager.publish_rider(rider_id, {
+        "type": "route_updated",
+        "data": {
+            "rider_id": rider_id,
+            "route": route_data
+        }
+    })
+    return route_data
+
+def _anytime_search(start: tuple, seq: list, capacity: float, budget: float, road_costs: bool,
+                    stop: threading.Event, emit):
+    """Run one anytime search to the end on the calling (worker) thread, emit()-ing each better sequence"""
+    search = routing.improve_route_anytime(start, seq, capacity, budget, road_costs=road_costs, stop=stop)
+    try:
+        for improved_seq, _ in search:
+            if stop.is_set():
+                break
+            emit(improved_seq)
+    finally:
+        search.close()
+
+async def run_anytime_improvement(rider, start: tuple, orders_data: list, route_data: dict, key: str, budget: float,
+                                  avoid_points: list = None, road_costs: bool = False):
+    """
+    Keep improving a freshly served route for budget seconds and push each better
+    one as route_updated (at most every ANYTIME_PUBLISH_INTERVAL_SECONDS). Stops
+    early once the rider's inputs change, i.e. the cached route for key is gone.
+    The search runs on one worker thread; cancelling this coroutine stops it.
+    """
+    if route_cache.route_cache.get(rider.id, key) is None:
+        return {"improvements": 0}
+    by_id = {o['id']: o for o in orders_data}
+    seq = [by_id[i] for i in route_order_ids(route_data, orders_data) if i in by_id]
+
+    loop = asyncio.get_running_loop()
+    improvements = asyncio.Queue()
+    stop = threading.Event()
+
+    def emit(improved_seq):
+        loop.call_soon_threadsafe(improvements.put_nowait, improved_seq)
+
+    search = asyncio.ensure_future(asyncio.to_thread(
+        _anytime_search, start, seq, rider.capacity or 10.0, budget, road_costs, stop, emit
+    ))
+    # None marks the end of the search
+    search.add_done_callback(lambda _: improvements.put_nowait(None))
+    revision = 0
+    last_publish = 0.0
+    try:
+        finished = False
+        while not finished:
+            best = await improvements.get()
+            if best is None:
+                break
+            wait = last_publish + ANYTIME_PUBLISH_INTERVAL_SECONDS - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # Only the latest of the improvements found meanwhile is worth publishing
+            while not improvements.empty():
+                latest = improvements.get_nowait()
+                if latest is None:
+                    finished = True
+                else:
+                    best = latest
+            if route_cache.route_cache.get(rider.id, key) is None:
+                break
+            points = [start] + [(o['lat'], o['lng']) for o in best]
+            improved = await routing.get_optimized_route_async(points, avoid_points=avoid_points, reorder=False)
+            if improved:
+                revision += 1
+                improved["order_ids"] = [o['id'] for o in best]
+                improved["revision"] = revision
+                if not routing.is_degraded(improved):
+                    route_cache.route_cache.put(rider.id, key, improved)
+                async with AsyncSessionLocal() as db:
+                    await persist_route(db, rider, improved, orders_data, fingerprint=key)
+                await manager.publish_rider(rider.id, {
+                    "type": "route_updated",
+                    "data": {
+                        "rider_id": rider.id,
+                        "route": improved,
+                        "anytime": True
+                    }
+                })
+            last_publish = time.monotonic()
+    except BaseException:
+        # Cancelled (e.g. shutdown): don't wait for the thread, it exits at its next step
+        stop.set()
+        search.cancel()
+        raise
+    stop.set()
+    await search
+    return {"improvements": revision}
+
+async def commit_assignments(db: AsyncSession, assignments: dict) -> dict:
+    """
+    Write {order_id: rider_id} with bulk UPDATEs, mark those riders busy and
+    drop their cached routes. Orders that stopped being pending meanwhile are
+    left untouched; returns the {order_id: rider_id} actually written.
+    """
+    applied = {}
+    items = list(assignments.items())
+    for i in range(0, len(items), ASSIGN_CHUNK_ROWS):
+        chunk = dict(items[i:i + ASSIGN_CHUNK_ROWS])
+        result = await db.execute(
+            update(models.Order)
+            .where(models.Order.id.in_(chunk), models.Order.status == models.OrderStatus.PENDING)
+            .values(rider_id=case(chunk, value=models.Order.id), status=models.OrderStatus.ASSIGNED)
+            .returning(models.Order.id, models.Order.rider_id)
+            .execution_options(synchronize_session=False)
+        )
+        applied.update(result.tuples().all())
+    affected_riders = set(applied.values())
+    if affected_riders:
+        await db.execute(
+            update(models.User)
+            .where(models.User.id.in_(affected_riders), models.User.status == models.RiderStatus.AVAILABLE)
+            .values(status=models.RiderStatus.BUSY)
+        )
+    await db.commit()
+    for rider_id in affected_riders:
+        route_cache.route_cache.invalidate(rider_id)
+    for rider_id, count in Counter(applied.values()).items():
+        order_stats.stats.transition(models.OrderStatus.PENDING, models.OrderStatus.ASSIGNED, None, rider_id, count)
+    return applied
+
+def schedule_reroute(rider_id: int):
+    """Queue a debounced re-route; back-to-back order changes for a rider share one run"""
+    return route_jobs.queue.submit(("reroute", rider_id), lambda: reroute_rider(rider_id), rider_id=rider_id)
+
+async def dispatch_orders(db: AsyncSession, pending_orders, force: bool = False) -> dict:
+    """
+    Dispatch the given pending orders (planning.OrderArrays) across all riders,
+    commit the assignments and queue re-routes. Returns auto-assign's response.
+    """
+    # All riders (case insensitive role), with live positions and on-board load
+    plan_input = await planning.load_plan_input(db)
+
+    if not plan_input.riders:
+        return {"message": "No riders found", "assigned": 0}
+    
+    vehicles = plan_input.vehicles()
+    if vehicles:
+        from fastapi.concurrency import run_in_threadpool
+        plan = await run_in_threadpool(dispatch.assign_orders, pending_orders, vehicles, force=force)
+        assignments = plan["assignments"]
+        unassigned = len(plan["unassigned"])
+    elif force:
+        # No rider has a known location: everything goes to the first rider
+        assignments = {order_id: plan_input.riders[0].id for order_id in pending_orders.ids.tolist()}
+        unassigned = 0
+    else:
+        return {"message": "No riders with a known location", "assigned": 0, "unassigned": len(pending_orders)}
+    
+    if not assignments:
+        return {"message": "No rider can take the pending orders", "assigned": 0, "unassigned": unassigned}
+    
+    assignments = await commit_assignments(db, assignments)
+    affected_riders = set(assignments.values())
+    assigned_count = len(assignments)
+
+    # Re-route affected riders in the background, across the job workers
+    jobs = {rider_id: schedule_reroute(rider_id).id for rider_id in affected_riders}
+    
+    # Broadcast general update
+    await manager.broadcast({
+        "type": "orders_assigned",
+        "count": assigned_count
+    })
+    
+    return {
+        "message": "Orders assigned successfully",
+        "assigned": assigned_count,
+        "unassigned": unassigned,
+        "riders_used": len(affected_riders),
+        "jobs": jobs
+    }
+
+def stored_route_data(db_route):
+    """Route dict in the same shape /optimize returns, from a stored Route row"""
+    return {
+        "distance": db_route.total_distance,
+        "time": db_route.total_time,
+        "points": {
+            "type": "LineString",
+            "coordinates": routing.decode_polyline(db_route.encoded_polyline or "")
+        },
+        "ordered_points": json.loads(db_route.waypoints or "[]"),
+        "order_ids": json.loads(db_route.order_sequence or "[]"),
+    }
+
 @app.post("/signup", response_model=schemas.Token)
 def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
     db_user = crud.get_user_by_email(db, email=user.email)
@@ -81,65 +373,153 @@ def read_users(role: str = None, db: Session = Depends(get_db), current_user: mo
     return db.query(models.User).all()
 
 @app.post("/orders/", response_model=schemas.Order)
-async def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    new_order = crud.create_order(db=db, order=order)
+async def create_order(order: schemas.OrderCreate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    new_order = await crud_async.create_order(db=db, order=order)
     return new_order
 
+def order_filters(status: Optional[List[str]] = Query(None), rider_id: Optional[int] = None,
+                  created_from: Optional[datetime] = None, created_to: Optional[datetime] = None,
+                  bbox: Optional[str] = None) -> list:
+    """WHERE criteria for order listings; bbox is min_lat,min_lng,max_lat,max_lng"""
+    criteria = []
+    if status:
+        criteria.append(models.Order.status.in_(status))
+    if rider_id is not None:
+        criteria.append(models.Order.rider_id == rider_id)
+    if created_from is not None:
+        criteria.append(models.Order.created_at >= schemas.naive_utc(created_from))
+    if created_to is not None:
+        criteria.append(models.Order.created_at < schemas.naive_utc(created_to))
+    if bbox:
+        try:
+            min_lat, min_lng, max_lat, max_lng = (float(v) for v in bbox.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="bbox must be min_lat,min_lng,max_lat,max_lng")
+        criteria.append(crud_async.orders_in_bbox(min_lat, min_lng, max_lat, max_lng))
+    return criteria
+
+@app.post("/orders/bulk")
+async def bulk_create_orders(request: Request, auto_assign: bool = False, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    """
+    Create many orders in one request. The body is a JSON array of orders, or
+    a streamed text/csv (header row) or application/x-ndjson file. Valid rows
+    are inserted in chunks; invalid ones are reported by row number. With
+    auto_assign=true the new orders are dispatched right away.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "text/csv":
+        rows = order_ingest.csv_rows(request.stream())
+    elif content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        rows = order_ingest.ndjson_rows(request.stream())
+    else:
+        try:
+            data = json.loads(await request.body() or b"[]")
+        except ValueError:
+            data = None
+        if not isinstance(data, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of orders")
+        rows = order_ingest.json_rows(data)
+
+    result = await order_ingest.ingest(db, rows)
+    if result.created:
+        await manager.broadcast({
+            "type": "orders_created",
+            "count": result.created
+        })
+
+    response = result.to_dict()
+    response["dispatch"] = None
+    if auto_assign and result.created:
+        # Only this upload's orders (still pending); other pending orders are left alone
+        ingested = await planning.load_orders_by_id(db, result.ids, models.Order.status == models.OrderStatus.PENDING)
+        response["dispatch"] = await dispatch_orders(db, ingested)
+    return response
+
 @app.get("/orders/", response_model=List[schemas.Order])
-def read_orders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    return crud.get_orders(db, skip=skip, limit=limit)
+async def read_orders(response: Response, cursor: Optional[int] = None, limit: int = 100, skip: int = 0,
+                      criteria: list = Depends(order_filters),
+                      db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    """
+    Orders in id order, filtered by status (repeatable), rider_id, created_from/
+    created_to and bbox. Pass the X-Next-Cursor header of a page as `cursor` to
+    get the next one; the header is absent on the last page.
+    """
+    limit = max(1, min(limit, ORDER_PAGE_MAX))
+    if cursor is None and skip:
+        # Legacy offset paging
+        result = await db.execute(select(models.Order).filter(*criteria).order_by(models.Order.id).offset(skip).limit(limit))
+        orders = result.scalars().all()
+    else:
+        orders = await crud_async.list_orders(db, criteria, cursor, limit)
+    if len(orders) == limit:
+        response.headers["X-Next-Cursor"] = str(orders[-1].id)
+    return orders
+
+def _export_value(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return getattr(value, "value", value)
+
+async def export_rows(criteria: list, fmt: str):
+    """Encoded export chunks, read through a server-side cursor EXPORT_BATCH_ROWS at a time"""
+    import csv
+    import io
+    columns = [getattr(models.Order, c) for c in EXPORT_COLUMNS]
+    if fmt == "csv":
+        yield ",".join(EXPORT_COLUMNS) + "\r\n"
+    # Own session: the request's session is closed before the body is streamed
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            select(*columns).filter(*criteria).order_by(models.Order.id),
+            execution_options={"yield_per": EXPORT_BATCH_ROWS}
+        )
+        async for batch in result.partitions():
+            rows = [[_export_value(v) for v in row] for row in batch]
+            if fmt == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in rows)
+
+@app.get("/orders/export")
+async def export_orders(format: str = "ndjson", criteria: list = Depends(order_filters),
+                        current_user: models.User = Depends(get_current_user)):
+    """
+    Stream every order matching the listing filters as NDJSON (default) or CSV,
+    without loading the result set into memory
+    """
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_rows(criteria, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=orders.{format}"}
+    )
 
 @app.get("/orders/available", response_model=List[schemas.Order])
 def read_available_orders(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     return crud.get_available_orders(db)
 
 @app.post("/orders/{order_id}/pick", response_model=schemas.Order)
-async def pick_order(order_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def pick_order(order_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != 'rider':
         raise HTTPException(status_code=403, detail="Only riders can pick orders")
     
     # Update status to IN_TRANSIT
-    order = crud.update_order_status(db, order_id, models.OrderStatus.IN_TRANSIT)
+    order = await crud_async.update_order_status(db, order_id, models.OrderStatus.IN_TRANSIT)
+    route_cache.route_cache.invalidate(current_user.id)
     
-    # Trigger route optimization for the rider
+    # Re-route in the background; the route_updated message follows when it is ready
     try:
         rider = current_user
-        orders = crud.get_rider_orders(db, rider.id)
-        
-        points = []
-        if rider.current_lat and rider.current_lng:
-            points.append((rider.current_lat, rider.current_lng))
+        schedule_reroute(rider.id)
         
-        orders_data = []
-        for o in orders:
-            # Only include IN_TRANSIT orders in route optimization
-            if o.status == models.OrderStatus.IN_TRANSIT:
-                points.append((o.lat, o.lng))
-                orders_data.append({
-                    'lat': o.lat,
-                    'lng': o.lng,
-                    'priority': o.priority if hasattr(o, 'priority') else 1,
-                    'weight': o.weight if hasattr(o, 'weight') else 1.0,
-                    'delivery_time_start': o.delivery_time_start if hasattr(o, 'delivery_time_start') else None,
-                    'delivery_time_end': o.delivery_time_end if hasattr(o, 'delivery_time_end') else None,
-                })
-        
-        if len(points) >= 2:
-            rider_capacity = rider.capacity if hasattr(rider, 'capacity') else 10.0
-            from fastapi.concurrency import run_in_threadpool
-            route_data = await run_in_threadpool(routing.get_optimized_route, points, orders_data, rider_capacity)
-            
-            # Broadcast route update
-            await manager.broadcast({
-                "type": "route_updated",
-                "data": {
-                    "rider_id": rider.id,
-                    "route": route_data
-                }
-            })
-            
         # Broadcast order assignment/update
-        await manager.broadcast({
+        await manager.publish_rider(rider.id, {
             "type": "order_assigned",
             "data": {
                 "order_id": order.id,
@@ -155,50 +535,27 @@ async def pick_order(order_id: int, db: Session = Depends(get_db), current_user:
 
 @app.put("/orders/{order_id}/status", response_model=schemas.Order)
 def update_order_status(order_id: int, status: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    return crud.update_order_status(db, order_id, status)
+    rider_id = db.query(models.Order.rider_id).filter(models.Order.id == order_id).scalar()
+    order = crud.update_order_status(db, order_id, status)
+    route_cache.route_cache.invalidate(rider_id)
+    return order
 
 @app.post("/orders/{order_id}/assign/{rider_id}", response_model=schemas.Order)
-async def assign_order(order_id: int, rider_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    order = crud.assign_order_to_rider(db, order_id, rider_id)
+async def assign_order(order_id: int, rider_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    previous_rider_id = await db.scalar(select(models.Order.rider_id).filter(models.Order.id == order_id))
+    order = await crud_async.assign_order_to_rider(db, order_id, rider_id)
+    route_cache.route_cache.invalidate(previous_rider_id)
+    route_cache.route_cache.invalidate(rider_id)
     
-    # Trigger route optimization for the rider
+    # Re-route in the background for the new rider (and the one that lost the order)
     try:
-        rider = db.query(models.User).filter(models.User.id == rider_id).first()
-        orders = crud.get_rider_orders(db, rider_id)
-        
-        points = []
-        if rider.current_lat and rider.current_lng:
-            points.append((rider.current_lat, rider.current_lng))
-        
-        orders_data = []
-        for o in orders:
-            points.append((o.lat, o.lng))
-            orders_data.append({
-                'lat': o.lat,
-                'lng': o.lng,
-                'priority': o.priority if hasattr(o, 'priority') else 1,
-                'weight': o.weight if hasattr(o, 'weight') else 1.0,
-                'delivery_time_start': o.delivery_time_start if hasattr(o, 'delivery_time_start') else None,
-                'delivery_time_end': o.delivery_time_end if hasattr(o, 'delivery_time_end') else None,
-            })
-        
-        if len(points) >= 2:
-            rider_capacity = rider.capacity if hasattr(rider, 'capacity') else 10.0
-            # Run routing in threadpool to avoid blocking event loop
-            from fastapi.concurrency import run_in_threadpool
-            route_data = await run_in_threadpool(routing.get_optimized_route, points, orders_data, rider_capacity)
-            
-            # Broadcast route update
-            await manager.broadcast({
-                "type": "route_updated",
-                "data": {
-                    "rider_id": rider_id,
-                    "route": route_data
-                }
-            })
+        rider = await crud_async.get_user(db, rider_id)
+        schedule_reroute(rider_id)
+        if previous_rider_id is not None and previous_rider_id != rider_id:
+            schedule_reroute(previous_rider_id)
             
         # Broadcast order assignment
-        await manager.broadcast({
+        await manager.publish_rider(rider.id, {
             "type": "order_assigned",
             "data": {
                 "order_id": order.id,
@@ -216,171 +573,235 @@ def read_rider_orders(rider_id: int, db: Session = Depends(get_db), current_user
     return crud.get_rider_orders(db, rider_id)
 
 @app.put("/riders/{rider_id}/location", response_model=schemas.User)
-async def update_location(rider_id: int, location: schemas.LocationUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    updated_rider = crud.update_rider_location(db, rider_id, location.lat, location.lng)
+async def update_location(rider_id: int, location: schemas.LocationUpdate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    rider = await crud_async.get_user(db, rider_id)
+    if not rider:
+        raise HTTPException(status_code=404, detail="Rider not found")
     
-    # Broadcast location update
-    await manager.broadcast({
-        "type": "rider_update",
-        "data": {
-            "rider_id": rider_id,
-            "lat": location.lat,
-            "lng": location.lng,
-            "name": updated_rider.name
-        }
-    })
+    # Latest-position store: flushed to the DB and broadcast in batches by telemetry
+    telemetry.store.record(rider_id, location.lat, location.lng, name=rider.name)
     
-    return updated_rider
+    return schemas.User.model_validate(rider).model_copy(update={"current_lat": location.lat, "current_lng": location.lng})
 
-# In-memory storage for traffic points (for demo purposes)
-TRAFFIC_POINTS = []
+@app.post("/riders/locations")
+async def update_locations(batch: List[schemas.RiderLocation], db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    """
+    Batch GPS fixes (e.g. buffered by the rider app). Fixes older than the stored one are ignored.
+    """
+    result = await db.execute(
+        select(models.User.id, models.User.name)
+        .filter(models.User.id.in_({fix.rider_id for fix in batch}))
+    )
+    names = dict(result.all())
+    accepted = 0
+    for fix in sorted(batch, key=lambda f: f.recorded_at.timestamp() if f.recorded_at else 0):
+        if fix.rider_id not in names:
+            continue
+        recorded_at = fix.recorded_at.timestamp() if fix.recorded_at else None
+        if telemetry.store.record(fix.rider_id, fix.lat, fix.lng, recorded_at, names[fix.rider_id]):
+            accepted += 1
+    return {"accepted": accepted, "received": len(batch)}
 
 @app.post("/traffic")
-def report_traffic(location: schemas.LocationUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    TRAFFIC_POINTS.append((location.lat, location.lng))
-    return {"message": "Traffic reported", "location": location}
+async def report_traffic(location: schemas.LocationUpdate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    # Cached routes need no invalidation: the incidents near a route are part of its key
+    incident = await traffic.report(db, location.lat, location.lng)
+    return {"message": "Traffic reported", "location": location, "incident_id": incident.id, "reports": incident.reports}
+
+@app.get("/traffic")
+async def read_traffic(db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    """Live (unexpired) traffic incidents"""
+    return [
+        {
+            "id": i.id,
+            "bounds": [[i.min_lat, i.min_lng], [i.max_lat, i.max_lng]],
+            "reports": i.reports,
+            "expires_at": i.expires_at,
+        }
+        for i in await traffic.active(db)
+    ]
 
 @app.post("/optimize/{rider_id}")
-def optimize_route(rider_id: int, avoid_traffic: bool = False, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    rider = crud.get_user(db, rider_id)
+async def optimize_route(rider_id: int, response: Response, avoid_traffic: bool = False, road_costs: bool = False, wait: bool = True, budget: float = 0.0, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    plan_input = await planning.load_plan_input(db, [rider_id])
+    rider = plan_input.rider(rider_id)
     if not rider:
         raise HTTPException(status_code=404, detail="Rider not found")
     
-    orders = crud.get_rider_orders(db, rider_id)
-    if not orders:
+    if not len(plan_input.orders):
         return {"message": "No orders assigned"}
 
-    points = []
-    if rider.current_lat and rider.current_lng:
-        points.append((rider.current_lat, rider.current_lng))
+    # Live position: users.current_lat/lng lag telemetry by up to one flush interval
+    start = plan_input.position(rider_id)
+    points = [start] if start is not None else []
     
-    # Prepare order data with constraints
-    orders_data = []
-    for order in orders:
-        # Only include IN_TRANSIT orders in route optimization
-        if order.status == models.OrderStatus.IN_TRANSIT:
-            points.append((order.lat, order.lng))
-            orders_data.append({
-                'lat': order.lat,
-                'lng': order.lng,
-                'priority': order.priority if hasattr(order, 'priority') else 1,
-                'weight': order.weight if hasattr(order, 'weight') else 1.0,
-                'delivery_time_start': order.delivery_time_start if hasattr(order, 'delivery_time_start') else None,
-                'delivery_time_end': order.delivery_time_end if hasattr(order, 'delivery_time_end') else None,
-            })
+    # Only IN_TRANSIT orders are routed
+    orders_data = plan_input.orders_of(rider_id, [models.OrderStatus.IN_TRANSIT])
+    points.extend((o['lat'], o['lng']) for o in orders_data)
         
     if len(points) < 2:
         # If no orders are picked up, return empty route or just rider location
         return {"points": points, "paths": [], "distance": 0, "time": 0}
 
-    # Get rider capacity
-    rider_capacity = rider.capacity if hasattr(rider, 'capacity') else 10.0
+    rider_capacity = rider.capacity or 10.0
+    
+    avoid_points = await traffic.route_areas(db, points) if avoid_traffic else None
     
-    avoid_points = TRAFFIC_POINTS if avoid_traffic else None
+    # Serve the cached route while orders, coarse position and traffic are unchanged
+    etag = route_cache.route_key(
+        rider_id, orders_data, *(start or (None, None)), avoid_points,
+        capacity=rider_capacity, road_costs=road_costs
+    )
+    cached = route_cache.route_cache.get(rider_id, etag)
+    if cached is None:
+        # A route stored by another worker (or before a restart) for the same inputs
+        db_route = await crud_async.get_route(db, rider_id)
+        if db_route is not None and db_route.fingerprint == etag:
+            cached = stored_route_data(db_route)
+            route_cache.route_cache.put(rider_id, etag, cached)
+    if cached is not None:
+        quoted_etag = route_etag(etag, cached)
+        if if_none_match == quoted_etag:
+            return Response(status_code=304, headers={"ETag": quoted_etag})
+        response.headers["ETag"] = quoted_etag
+        return cached
     
-    route_data = routing.get_optimized_route(points, orders_data, rider_capacity, avoid_points=avoid_points)
+    anytime_jobs = []
     
-    if route_data:
+    async def compute():
+        # Another request may have solved these inputs while this one waited
+        cached = route_cache.route_cache.get(rider_id, etag)
+        if cached is not None:
+            return cached
+        route_data = await routing.get_optimized_route_async(points, orders_data, rider_capacity, avoid_points=avoid_points, road_costs=road_costs)
+        if route_data and not routing.is_degraded(route_data):
+            # Fallback routes are served but not cached, so the next poll retries GraphHopper
+            route_cache.route_cache.put(rider_id, etag, route_data)
+            async with AsyncSessionLocal() as job_db:
+                await persist_route(job_db, rider, route_data, orders_data, fingerprint=etag)
+            # Anytime mode: keep searching in the background (small loads are already solved exactly)
+            budget_seconds = min(budget, ANYTIME_MAX_BUDGET_SECONDS)
+            if budget_seconds > 0 and start is not None and len(orders_data) > routing.EXACT_TSP_MAX_STOPS:
+                anytime_jobs.append(route_jobs.anytime_queue.submit(
+                    ("anytime", rider_id, etag),
+                    lambda: run_anytime_improvement(rider, start, orders_data, route_data, etag, budget_seconds, avoid_points, road_costs),
+                    rider_id=rider_id, delay=0
+                ))
         return route_data
+    
+    # Concurrent polls for the same inputs share one solve, run on the bounded job workers
+    job = route_jobs.queue.submit(("optimize", rider_id, etag), compute, rider_id=rider_id, delay=0, share_running=True)
+    if not wait:
+        response.status_code = 202
+        return job.to_dict(include_result=False)
+    await route_jobs.queue.wait(job)
+    
+    if job.result:
+        response.headers["ETag"] = route_etag(etag, job.result)
+        if anytime_jobs:
+            response.headers["X-Route-Job"] = anytime_jobs[0].id
+        return job.result
     else:
         raise HTTPException(status_code=500, detail="Routing failed")
 
+@app.get("/route-jobs/{job_id}")
+async def read_route_job(job_id: str, current_user: models.User = Depends(get_current_user)):
+    """
+    Status of a background routing job, with its route once finished
+    """
+    job = route_jobs.queue.get(job_id) or route_jobs.anytime_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/riders/{rider_id}/route", response_model=schemas.StoredRoute)
+def read_rider_route(rider_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """
+    Latest stored route for a rider, served without recomputation
+    """
+    db_route = crud.get_route(db, rider_id)
+    if not db_route:
+        raise HTTPException(status_code=404, detail="No stored route for rider")
+    return {
+        "rider_id": rider_id,
+        "encoded_polyline": db_route.encoded_polyline,
+        "fingerprint": db_route.fingerprint,
+        "updated_at": db_route.updated_at,
+        **stored_route_data(db_route)
+    }
+
 @app.post("/orders/auto-assign")
-async def auto_assign_orders(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def auto_assign_orders(force: bool = False, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
     """
-    Force assign ALL pending orders to available riders irrespective of capacity.
+    Assign pending orders to riders in one batch, respecting rider capacity
+    (including orders already on board) and delivery windows.
+    With force=True, orders no rider can take go to the nearest rider anyway.
     """
-    # Get all pending orders
-    pending_orders = db.query(models.Order).filter(models.Order.status == models.OrderStatus.PENDING).all()
+    # Two queries whatever the fleet size: pending orders, then riders joined with what they carry
+    pending_orders = await planning.load_orders(db, models.Order.status == models.OrderStatus.PENDING)
     
-    if not pending_orders:
+    if not len(pending_orders):
         return {"message": "No pending orders", "assigned": 0}
     
-    # Get ALL riders (case insensitive)
-    riders = db.query(models.User).filter(models.User.role.ilike('rider')).all()
+    return await dispatch_orders(db, pending_orders, force=force)
 
-    if not riders:
-        return {"message": "No riders found", "assigned": 0}
-    
-    assigned_count = 0
-    affected_riders = set()
-    
-    # Assign each order
-    for order in pending_orders:
-        # If only one rider, assign to them directly
-        if len(riders) == 1:
-            nearest_rider = riders[0]
-        else:
-            # Find nearest rider (ignoring capacity)
-            nearest_rider = min(
-                riders,
-                key=lambda r: routing.calculate_distance(
-                    (r.current_lat, r.current_lng),
-                    (order.lat, order.lng)
-                ) if r.current_lat and r.current_lng else float('inf')
-            )
-        
-        # Assign order
-        order.rider_id = nearest_rider.id
-        order.status = models.OrderStatus.ASSIGNED
-        assigned_count += 1
-        
-        # Mark rider as busy if not already
-        if nearest_rider.status == models.RiderStatus.AVAILABLE:
-            nearest_rider.status = models.RiderStatus.BUSY
-            
-        affected_riders.add(nearest_rider.id)
-    
-    db.commit()
+@app.post("/orders/plan-fleet")
+async def plan_fleet(time_limit: float = 2.0, road_costs: bool = False, starts: Optional[int] = None, zoned: Optional[bool] = None, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    """
+    Plan all pending orders across available riders in one CVRPTW solve.
+    Large instances run `starts` randomised solves across the solver processes
+    and keep the best plan. City-scale instances (or zoned=true) are split into
+    geographic zones solved in parallel instead. Orders that do not fit any
+    rider's capacity or time windows stay pending.
+    """
+    pending_orders = await planning.load_orders(db, models.Order.status == models.OrderStatus.PENDING)
+    if not len(pending_orders):
+        return {"message": "No pending orders", "assigned": 0}
+
+    plan_input = await planning.load_plan_input(db, rider_criteria=(
+        models.User.status == models.RiderStatus.AVAILABLE,
+        models.User.current_lat != None,
+        models.User.current_lng != None
+    ))
+    vehicles = plan_input.vehicles()
+    if not vehicles:
+        return {"message": "No available riders", "assigned": 0}
+
+    orders_data = pending_orders.records()
+
+    from fastapi.concurrency import run_in_threadpool
+    if zoned is None:
+        zoned = len(orders_data) >= solver_pool.ZONED_MIN_ORDERS
+    if zoned:
+        plan = await run_in_threadpool(solver_pool.solve_vrp_zoned, orders_data, vehicles, time_limit, road_costs=road_costs)
+    else:
+        plan = await run_in_threadpool(solver_pool.solve_vrp_parallel, orders_data, vehicles, time_limit, starts, road_costs=road_costs)
+
+    assignments = {o['id']: route["vehicle_id"] for route in plan["routes"] for o in route["orders"]}
+    if assignments:
+        assignments = await commit_assignments(db, assignments)
+    assigned_count = len(assignments)
+
+    # Keep the planned stop order; road geometry is fetched by the route jobs
+    jobs = {}
+    for route in plan["routes"]:
+        route_editor.editor.seed(route["vehicle_id"], route["orders"])
+        jobs[route["vehicle_id"]] = schedule_reroute(route["vehicle_id"]).id
 
-    # Trigger route optimization for affected riders
-    for rider_id in affected_riders:
-        try:
-            rider = db.query(models.User).filter(models.User.id == rider_id).first()
-            orders = crud.get_rider_orders(db, rider_id)
-            
-            points = []
-            if rider.current_lat and rider.current_lng:
-                points.append((rider.current_lat, rider.current_lng))
-            
-            orders_data = []
-            for order in orders:
-                points.append((order.lat, order.lng))
-                orders_data.append({
-                    'lat': order.lat,
-                    'lng': order.lng,
-                    'priority': order.priority if hasattr(order, 'priority') else 1,
-                    'weight': order.weight if hasattr(order, 'weight') else 1.0,
-                    'delivery_time_start': order.delivery_time_start if hasattr(order, 'delivery_time_start') else None,
-                    'delivery_time_end': order.delivery_time_end if hasattr(order, 'delivery_time_end') else None,
-                })
-            
-            if len(points) >= 2:
-                rider_capacity = rider.capacity if hasattr(rider, 'capacity') else 10.0
-                from fastapi.concurrency import run_in_threadpool
-                route_data = await run_in_threadpool(routing.get_optimized_route, points, orders_data, rider_capacity)
-                
-                # Broadcast route update
-                await manager.broadcast({
-                    "type": "route_updated",
-                    "data": {
-                        "rider_id": rider_id,
-                        "route": route_data
-                    }
-                })
-        except Exception as e:
-            print(f"Error optimizing route for rider {rider_id}: {e}")
-    
-    # Broadcast general update
     await manager.broadcast({
         "type": "orders_assigned",
         "count": assigned_count
     })
-    
+
     return {
-        "message": "Orders assigned successfully",
+        "message": "Fleet planned successfully",
         "assigned": assigned_count,
-        "riders_used": len(affected_riders)
+        "unassigned": len(plan["unassigned"]),
+        "riders_used": len(plan["routes"]),
+        "solve_time": plan["solve_time"],
+        "starts": plan.get("starts", 1),
+        "zones": plan.get("zones", 0),
+        "jobs": jobs
     }
 
 @app.post("/riders/{rider_id}/pick-all")
@@ -390,47 +811,87 @@ def pick_all_orders(rider_id: int, db: Session = Depends(get_db), current_user:
     for order in orders:
         order.status = models.OrderStatus.IN_TRANSIT # or PICKED_UP
     db.commit()
+    order_stats.stats.transition(models.OrderStatus.ASSIGNED, models.OrderStatus.IN_TRANSIT,
+                                 rider_id, rider_id, count=len(orders))
+    route_cache.route_cache.invalidate(rider_id)
     return {"message": f"Picked up {len(orders)} orders"}
 
-# WebSocket Connection Manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
+async def websocket_user(token: str = None):
+    """User behind a /ws token, or None for anonymous/invalid tokens"""
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    except JWTError:
+        return None
+    async with AsyncSessionLocal() as db:
+        return await crud_async.get_user_by_email(db, email=payload.get("sub"))
 
-manager = ConnectionManager()
+def websocket_topics(user) -> list:
+    """Default subscriptions for a socket: riders get their own topic, admins the admin feed"""
+    topics = [connection_manager.GLOBAL_TOPIC]
+    if user is None:
+        return topics
+    if user.role == 'rider':
+        topics.append(connection_manager.rider_topic(user.id))
+    else:
+        topics.append(connection_manager.ADMIN_TOPIC)
+    return topics
+
+def websocket_topic_allowed(user, topic) -> bool:
+    """Anyone may follow the global feed; riders only their own topic; admins every topic"""
+    if topic == connection_manager.GLOBAL_TOPIC:
+        return True
+    if user is None or not isinstance(topic, str):
+        return False
+    if user.role == 'rider':
+        return topic == connection_manager.rider_topic(user.id)
+    return topic == connection_manager.ADMIN_TOPIC or topic.startswith(("zone:", "rider:"))
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket, token: str = None):
-    await manager.connect(websocket)
+    user = await websocket_user(token)
+    await manager.connect(websocket, websocket_topics(user))
     try:
         while True:
             data = await websocket.receive_text()
-            # Keep connection alive
-            await websocket.send_json({"type": "ping", "data": "pong"})
+            try:
+                message = json.loads(data)
+            except ValueError:
+                message = None
+            if isinstance(message, dict) and message.get("type") == "subscribe":
+                topics = message.get("topics") or []
+                topics = topics if isinstance(topics, list) else [topics]
+                allowed = [t for t in topics if websocket_topic_allowed(user, t)]
+                manager.subscribe(websocket, allowed)
+                if len(allowed) < len(topics):
+                    await manager.send(websocket, {
+                        "type": "error",
+                        "data": f"Not allowed to subscribe to: {', '.join(str(t) for t in topics if t not in allowed)}"
+                    })
+            elif isinstance(message, dict) and message.get("type") == "unsubscribe":
+                manager.unsubscribe(websocket, message.get("topics", []))
+            elif isinstance(message, dict) and message.get("type") == "location":
+                # Streamed GPS fix from the rider's own socket: no reply, no DB write here
+                if user is not None and user.role == 'rider':
+                    try:
+                        recorded_at = float(message["recorded_at"]) if message.get("recorded_at") else None
+                        telemetry.store.record(user.id, float(message["lat"]), float(message["lng"]),
+                                               recorded_at, user.name)
+                    except (KeyError, TypeError, ValueError):
+                        await manager.send(websocket, {"type": "error", "data": "Invalid location message"})
+            else:
+                # Keep connection alive
+                await manager.send(websocket, {"type": "ping", "data": "pong"})
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
 @app.post("/orders/{order_id}/cancel")
-async def cancel_order(order_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def cancel_order(order_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
     """
     Cancel an order and trigger re-routing for affected rider
     """
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    order = await crud_async.get_order(db, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -443,7 +904,9 @@ async def cancel_order(order_id: int, db: Session = Depends(get_db), current_use
     # Cancel the order
     order.status = models.OrderStatus.CANCELLED
     order.rider_id = None
-    db.commit()
+    await db.commit()
+    order_stats.stats.transition(old_status, models.OrderStatus.CANCELLED, affected_rider_id, None)
+    route_cache.route_cache.invalidate(affected_rider_id)
     
     # Broadcast order cancellation to all connected clients
     await manager.broadcast({
@@ -455,76 +918,60 @@ async def cancel_order(order_id: int, db: Session = Depends(get_db), current_use
         }
     })
     
-    # If order was assigned to a rider, re-optimize their remaining orders
-    if affected_rider_id:
-        remaining_orders = db.query(models.Order).filter(
-            models.Order.rider_id == affected_rider_id,
-            models.Order.status != models.OrderStatus.CANCELLED,
-            models.Order.status != models.OrderStatus.DELIVERED
-        ).all()
-        
-        if remaining_orders:
-            # Re-optimize route for this rider
-            try:
-                points = [(o.lat, o.lng) for o in remaining_orders]
-                orders_data = [
-                    {
-                        'id': o.id,
-                        'priority': o.priority,
-                        'weight': o.weight,
-                        'delivery_time_start': o.delivery_time_start,
-                        'delivery_time_end': o.delivery_time_end
-                    }
-                    for o in remaining_orders
-                ]
-                
-                rider = db.query(models.User).filter(models.User.id == affected_rider_id).first()
-                rider_capacity = rider.capacity if hasattr(rider, 'capacity') else 10.0
-                
-                route_data = routing.get_optimized_route(points, orders_data, rider_capacity)
-                
-                # Broadcast route update
-                await manager.broadcast({
-                    "type": "route_updated",
-                    "data": {
-                        "rider_id": affected_rider_id,
-                        "route": route_data
-                    }
-                })
-            except Exception as e:
-                print(f"Error re-optimizing route: {e}")
+    # If order was assigned to a rider, re-route their remaining orders in the background
+    job = schedule_reroute(affected_rider_id) if affected_rider_id else None
     
     return {
         "message": "Order cancelled successfully",
         "order_id": order_id,
         "affected_rider": affected_rider_id,
-        "re_optimized": affected_rider_id is not None
+        "re_optimized": affected_rider_id is not None,
+        "job_id": job.id if job else None
+    }
+
+@app.get("/orders/stats")
+async def get_order_stats(db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
+    """
+    Get order statistics (in-memory counters, reconciled with the DB in the background)
+    """
+    if order_stats.stats.reconciled_at is None:
+        await order_stats.reconcile(db)
+    totals = order_stats.stats.totals()
+    return {
+        "total": totals["total"],
+        "pending": totals[models.OrderStatus.PENDING.value],
+        "assigned": totals[models.OrderStatus.ASSIGNED.value],
+        "in_transit": totals[models.OrderStatus.IN_TRANSIT.value],
+        "delivered": totals[models.OrderStatus.DELIVERED.value],
+        "cancelled": totals[models.OrderStatus.CANCELLED.value]
     }
 
 @app.get("/orders/{order_id}")
-async def get_order(order_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def get_order(order_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
     """
     Get a specific order by ID
     """
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    order = await crud_async.get_order(db, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     return order
 
 @app.delete("/orders/{order_id}")
-async def delete_order(order_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def delete_order(order_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
     """
     Permanently delete an order from the database
     """
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    order = await crud_async.get_order(db, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     affected_rider_id = order.rider_id
     
     # Delete the order
-    db.delete(order)
-    db.commit()
+    await crud_async.delete_order(db, order)
+    route_cache.route_cache.invalidate(affected_rider_id)
+    if affected_rider_id:
+        schedule_reroute(affected_rider_id)
     
     # Broadcast order deletion
     await manager.broadcast({
@@ -540,41 +987,18 @@ async def delete_order(order_id: int, db: Session = Depends(get_db), current_use
         "order_id": order_id
     }
 
-@app.get("/orders/stats")
-async def get_order_stats(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    """
-    Get order statistics
-    """
-    total = db.query(models.Order).count()
-    pending = db.query(models.Order).filter(models.Order.status == models.OrderStatus.PENDING).count()
-    assigned = db.query(models.Order).filter(models.Order.status == models.OrderStatus.ASSIGNED).count()
-    in_transit = db.query(models.Order).filter(models.Order.status == models.OrderStatus.IN_TRANSIT).count()
-    delivered = db.query(models.Order).filter(models.Order.status == models.OrderStatus.DELIVERED).count()
-    cancelled = db.query(models.Order).filter(models.Order.status == models.OrderStatus.CANCELLED).count()
-    
-    return {
-        "total": total,
-        "pending": pending,
-        "assigned": assigned,
-        "in_transit": in_transit,
-        "delivered": delivered,
-        "cancelled": cancelled
-    }
-
 @app.get("/riders/{rider_id}/stats")
-async def get_rider_stats(rider_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def get_rider_stats(rider_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user)):
     """
     Get rider statistics
     """
-    rider = db.query(models.User).filter(models.User.id == rider_id).first()
+    rider = await crud_async.get_user(db, rider_id)
     if not rider:
         raise HTTPException(status_code=404, detail="Rider not found")
     
-    total_orders = db.query(models.Order).filter(models.Order.rider_id == rider_id).count()
-    active_orders = db.query(models.Order).filter(
-        models.Order.rider_id == rider_id,
-        models.Order.status.in_([models.OrderStatus.ASSIGNED, models.OrderStatus.IN_TRANSIT])
-    ).count()
+    if order_stats.stats.reconciled_at is None:
+        await order_stats.reconcile(db)
+    total_orders, active_orders = order_stats.stats.rider(rider_id)
     
     return {
         "rider_id": rider_id,
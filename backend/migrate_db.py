@@ -1,61 +1,221 @@
 """
-Database migration script to add order grouping fields.
-Run this script after updating models.py to add new columns to existing database.
+Versioned database migrations. Each migration runs once, in order, inside
+its own transaction (index builds on PostgreSQL excepted, see
+CONCURRENT_MIGRATIONS) and is recorded in schema_migrations. Run this script
+after updating models.py to bring an existing database up to date:
+
+    python migrate_db.py                 # apply pending migrations
+    python migrate_db.py --check-plans   # fail if a hot orders query scans the table
 """
-from sqlalchemy import text
+import json
+import sys
+from datetime import datetime
+
+from sqlalchemy import inspect, text
 from database import engine
 
+def _add_columns(connection, table: str, columns: list):
+    """ALTER TABLE ... ADD COLUMN for the (name, type) pairs the table does not have yet"""
+    existing = {c["name"] for c in inspect(connection).get_columns(table)}
+    for name, column_type in columns:
+        if name not in existing:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
+
+def order_grouping_columns(connection):
+    # Time windows, priority (1=high, 2=medium, 3=low) and weight (kg) on orders
+    _add_columns(connection, "orders", [
+        ("delivery_time_start", "TIMESTAMP"),
+        ("delivery_time_end", "TIMESTAMP"),
+        ("priority", "INTEGER DEFAULT 2"),
+        ("weight", "FLOAT DEFAULT 1.0"),
+    ])
+    # Capacity on riders
+    _add_columns(connection, "users", [("capacity", "FLOAT DEFAULT 10.0")])
+
+def route_persistence(connection):
+    _add_columns(connection, "routes", [
+        ("order_sequence", "VARCHAR"),
+        ("waypoints", "VARCHAR"),
+        ("fingerprint", "VARCHAR"),
+        ("updated_at", "TIMESTAMP"),
+    ])
+    connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_routes_rider_id ON routes (rider_id)"))
+
+def _create_index(connection, name: str, definition: str):
+    """
+    CREATE INDEX IF NOT EXISTS name ON definition. On PostgreSQL the index is
+    built CONCURRENTLY, so writes to a live table are not blocked meanwhile.
+    """
+    if connection.dialect.name != "postgresql":
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}"))
+        return
+    # A failed concurrent build leaves an invalid index behind that IF NOT EXISTS would keep
+    invalid = connection.execute(text(
+        "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+        "WHERE pg_class.relname = :name AND NOT pg_index.indisvalid"
+    ), {"name": name}).first()
+    if invalid:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+
+def order_access_indexes(connection):
+    # Rider's orders by status (reroutes, /optimize, cancel, rider stats, the planning loader)
+    _create_index(connection, "ix_orders_rider_status", "orders (rider_id, status)")
+    # Status filters and counts, newest first within a status
+    _create_index(connection, "ix_orders_status_created", "orders (status, created_at)")
+    # Dispatch only ever reads the pending slice; keep its index that small
+    _create_index(connection, "ix_orders_pending", "orders (created_at) WHERE status = 'pending'")
+    # Available riders
+    _create_index(connection, "ix_users_role_status", "users (role, status)")
+    # Map / bounding-box lookups
+    if connection.dialect.name == "postgresql":
+        _create_index(connection, "ix_orders_location", "orders USING gist (point(lng, lat))")
+    else:
+        _create_index(connection, "ix_orders_lat_lng", "orders (lat, lng)")
+
+# (version, migration); append new ones, never renumber
+MIGRATIONS = [
+    (1, order_grouping_columns),
+    (2, route_persistence),
+    (3, order_access_indexes),
+]
+# Migrations that only build indexes: on PostgreSQL they run in autocommit mode,
+# since CREATE INDEX CONCURRENTLY cannot run inside a transaction. They must be
+# safe to re-run, as a failure part way leaves the earlier indexes in place.
+CONCURRENT_MIGRATIONS = {order_access_indexes}
+
+def _applied_versions(connection) -> set:
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR,
+            applied_at TIMESTAMP
+        )
+    """))
+    return {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+def _record(connection, version: int, migration):
+    connection.execute(
+        text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+        {"v": version, "n": migration.__name__, "t": datetime.utcnow()}
+    )
+
 def migrate():
     print("Starting database migration...")
-    
+
+    with engine.begin() as connection:
+        applied = _applied_versions(connection)
+
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        print(f"Applying migration {version}: {migration.__name__}...")
+        if migration in CONCURRENT_MIGRATIONS and engine.dialect.name == "postgresql":
+            try:
+                with engine.connect() as connection:
+                    migration(connection.execution_options(isolation_level="AUTOCOMMIT"))
+                with engine.begin() as connection:
+                    _record(connection, version, migration)
+            except Exception as e:
+                print(f"Migration {version} failed: {e}")
+                raise
+            continue
+        with engine.connect() as connection:
+            trans = connection.begin()
+            try:
+                migration(connection)
+                _record(connection, version, migration)
+                trans.commit()
+            except Exception as e:
+                # Rollback on error; later migrations may depend on this one
+                trans.rollback()
+                print(f"Migration {version} failed: {e}")
+                raise
+
+    print("Migration completed successfully!")
+
+def hot_queries() -> dict:
+    """
+    name -> (statement, full_pass) for the hot orders queries, built by the
+    same functions the app issues them through, so the check follows the code.
+    full_pass marks a deliberate pass over every order, which must still be
+    served from an index alone.
+    """
+    import crud_async, models, order_stats, planning
+    Order = models.Order
+    return {
+        "pending orders (dispatch)": (planning.orders_query(Order.status == models.OrderStatus.PENDING), False),
+        "rider plan input": (planning.plan_input_query([1]), False),
+        "fleet plan input": (planning.plan_input_query(), False),
+        "orders page by status": (
+            crud_async.orders_page_query([Order.status.in_([models.OrderStatus.DELIVERED])], after_id=1000), False
+        ),
+        "orders page by rider": (crud_async.orders_page_query([Order.rider_id == 1]), False),
+        "orders page in bbox": (crud_async.orders_page_query([crud_async.orders_in_bbox(12.9, 77.5, 13.0, 77.6)]), False),
+        "status counts (reconcile)": (order_stats.COUNTS_QUERY, True),
+    }
+
+def _partial_indexes(connection) -> set:
+    """Names of the partial indexes on orders; reading one whole is reading only its slice"""
+    if connection.dialect.name == "sqlite":
+        # index_list rows: seq, name, unique, origin, partial
+        return {row[1] for row in connection.exec_driver_sql("PRAGMA index_list(orders)") if row[4]}
+    return {row[0] for row in connection.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'orders' AND indexdef LIKE '% WHERE %'"
+    ))}
+
+def _sqlite_full_reads(plan_rows, full_pass: bool, partial: set) -> list:
+    """EXPLAIN QUERY PLAN lines that read every row of orders, from the table or a whole index"""
+    reads = []
+    for row in plan_rows:
+        line = str(row[-1])
+        if not line.startswith("SCAN orders"):
+            continue
+        if full_pass and "COVERING INDEX" in line or line.split()[-1] in partial:
+            continue
+        reads.append(line)
+    return reads
+
+def _postgres_full_reads(node: dict, full_pass: bool, partial: set) -> list:
+    """Plan nodes that read every row of orders, from the table or a whole index"""
+    reads = []
+    if node.get("Relation Name") == "orders":
+        kind = node["Node Type"]
+        whole_index = (kind in ("Index Scan", "Index Only Scan") and "Index Cond" not in node
+                       and node.get("Index Name") not in partial)
+        if kind == "Seq Scan" or whole_index and not (full_pass and kind == "Index Only Scan"):
+            reads.append(f"{kind} on orders" + (f" using {node['Index Name']}" if "Index Name" in node else ""))
+    for child in node.get("Plans", []):
+        reads.extend(_postgres_full_reads(child, full_pass, partial))
+    return reads
+
+def check_query_plans() -> list:
+    """
+    EXPLAIN every hot orders query and return the names of those whose plan
+    reads all of orders. On PostgreSQL sequential scans are disabled for the
+    check, so a small table does not hide a missing index.
+    """
+    failures = []
     with engine.connect() as connection:
-        # Start transaction
-        trans = connection.begin()
-        
-        try:
-            # Add columns to orders table
-            print("Adding columns to orders table...")
-            
-            # Add delivery_time_start column
-            connection.execute(text("""
-                ALTER TABLE orders 
-                ADD COLUMN IF NOT EXISTS delivery_time_start TIMESTAMP
-            """))
-            
-            # Add delivery_time_end column
-            connection.execute(text("""
-                ALTER TABLE orders 
-                ADD COLUMN IF NOT EXISTS delivery_time_end TIMESTAMP
-            """))
-            
-            # Add priority column (1=high, 2=medium, 3=low)
-            connection.execute(text("""
-                ALTER TABLE orders 
-                ADD COLUMN IF NOT EXISTS priority INTEGER DEFAULT 2
-            """))
-            
-            # Add weight column (in kg)
-            connection.execute(text("""
-                ALTER TABLE orders 
-                ADD COLUMN IF NOT EXISTS weight FLOAT DEFAULT 1.0
-            """))
-            
-            # Add capacity column to users table
-            print("Adding capacity column to users table...")
-            connection.execute(text("""
-                ALTER TABLE users 
-                ADD COLUMN IF NOT EXISTS capacity FLOAT DEFAULT 10.0
-            """))
-            
-            # Commit transaction
-            trans.commit()
-            print("Migration completed successfully!")
-            
-        except Exception as e:
-            # Rollback on error
-            trans.rollback()
-            print(f"Migration failed: {e}")
-            raise
+        dialect = connection.dialect.name
+        partial = _partial_indexes(connection)
+        if dialect == "postgresql":
+            connection.execute(text("SET enable_seqscan = off"))
+        for name, (statement, full_pass) in hot_queries().items():
+            sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+            if dialect == "sqlite":
+                reads = _sqlite_full_reads(connection.exec_driver_sql("EXPLAIN QUERY PLAN " + sql), full_pass, partial)
+            else:
+                plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                reads = _postgres_full_reads(plan[0]["Plan"], full_pass, partial)
+            print(f"{'FAIL' if reads else 'ok  '} {name}" + "".join(f"\n       {line}" for line in reads))
+            if reads:
+                failures.append(name)
+    return failures
 
 if __name__ == "__main__":
+    if "--check-plans" in sys.argv:
+        sys.exit(1 if check_query_plans() else 0)
     migrate()
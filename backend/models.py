@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Enum
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Enum, Index, func, text
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -34,6 +34,10 @@ class User(Base):
 
     orders = relationship("Order", back_populates="rider")
 
+    __table_args__ = (
+        Index("ix_users_role_status", "role", "status"),
+    )
+
 class Order(Base):
     __tablename__ = "orders"
 
@@ -54,13 +58,42 @@ class Order(Base):
     rider_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     rider = relationship("User", back_populates="orders")
 
+    # Hot access paths (kept in step with migrate_db.py)
+    __table_args__ = (
+        Index("ix_orders_rider_status", "rider_id", "status"),
+        Index("ix_orders_status_created", "status", "created_at"),
+        # Only the small pending slice of a large order history
+        Index("ix_orders_pending", "created_at",
+              postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+    )
+
+# Geospatial lookups: GiST over point(lng, lat) on PostgreSQL, a plain (lat, lng) B-tree on SQLite
+Index("ix_orders_location", func.point(Order.lng, Order.lat), postgresql_using="gist").ddl_if(dialect="postgresql")
+Index("ix_orders_lat_lng", Order.lat, Order.lng).ddl_if(dialect="sqlite")
+
 class Route(Base):
     __tablename__ = "routes"
     
     id = Column(Integer, primary_key=True, index=True)
-    rider_id = Column(Integer, ForeignKey("users.id"))
-    # Store route geometry or waypoints as JSON string or similar if needed
-    # For simplicity, we might just link orders to riders and calculate route on fly or store encoded polyline
+    rider_id = Column(Integer, ForeignKey("users.id"), unique=True, index=True)  # Latest route per rider
+    # Route geometry as a Google encoded polyline (precision 5)
     encoded_polyline = Column(String, nullable=True) 
     total_distance = Column(Float, nullable=True)
     total_time = Column(Float, nullable=True)
+    order_sequence = Column(String, nullable=True)  # JSON list of order ids in visiting order
+    waypoints = Column(String, nullable=True)       # JSON list of [lat, lng] stops, rider first
+    fingerprint = Column(String, nullable=True)     # route_cache.route_key of the inputs
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class TrafficIncident(Base):
+    __tablename__ = "traffic_incidents"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # Area to keep routes out of, grown as nearby reports are merged in
+    min_lat = Column(Float)
+    min_lng = Column(Float)
+    max_lat = Column(Float)
+    max_lng = Column(Float)
+    reports = Column(Integer, default=1)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, index=True)  # Refreshed by every merged report
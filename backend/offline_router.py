@@ -0,0 +1,273 @@
+"""
+Offline road routing used while GraphHopper is unreachable (restarts and
+re-imports take minutes on the India extract). The road graph is built once
+from the same OSM extract GraphHopper imports and stored as flat numpy arrays
+in compressed-sparse-row form; they are memory-mapped at load time, so
+opening the graph is instant and every worker shares the page cache. Routes
+come from A* on travel time. It is slower than GraphHopper and knows nothing
+about turn costs or blocked areas, but the distances and ETAs are real.
+
+Build (needs `pip install osmium`; a --bbox around the city keeps it small):
+    python offline_router.py india-251225.osm.pbf offline-graph --bbox 12.7,77.3,13.3,77.9
+"""
+import heapq
+import math
+import os
+import shutil
+import threading
+from typing import Optional
+
+import numpy as np
+
+import routing
+from spatial import KM_PER_DEG_LAT
+
+OFFLINE_GRAPH_DIR = os.getenv("OFFLINE_GRAPH_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "offline-graph"))
+# Nodes are stored sorted by this grid so snapping is a few binary searches
+SNAP_CELL_DEG = 0.01
+SNAP_MAX_KM = 1.0
+# Give up on a leg after settling this many nodes (unreachable / disconnected extract)
+MAX_SETTLED_NODES = 1_000_000
+
+# Free-flow car speeds by OSM highway class, kept a little under GraphHopper's car profile
+HIGHWAY_SPEED_KMPH = {
+    "motorway": 80, "motorway_link": 45,
+    "trunk": 60, "trunk_link": 40,
+    "primary": 45, "primary_link": 35,
+    "secondary": 40, "secondary_link": 30,
+    "tertiary": 35, "tertiary_link": 25,
+    "unclassified": 25, "residential": 20, "living_street": 10,
+    "service": 15, "road": 20,
+}
+MAX_SPEED_KMPH = max(HIGHWAY_SPEED_KMPH.values())
+# Speed for the straight hop between a stop and its snapped road node
+ACCESS_SPEED_KMPH = 10.0
+
+GRAPH_ARRAYS = ("lat", "lng", "cell", "offsets", "targets", "length", "duration")
+
+def _cell_keys(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    rows = np.floor(np.asarray(lat) / SNAP_CELL_DEG).astype(np.int64) + 20000
+    cols = np.floor(np.asarray(lng) / SNAP_CELL_DEG).astype(np.int64) + 20000
+    return rows * 100000 + cols
+
+def write_graph(out_dir: str, lat, lng, source, target, length_m, duration_s):
+    """
+    Compact a directed edge list over nodes 0..n-1 into the on-disk layout:
+    nodes sorted by snapping cell, edges in CSR order by source node.
+    The directory is swapped in whole; running workers keep their (unlinked) old maps.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    cell = _cell_keys(lat, lng)
+    order = np.argsort(cell, kind="stable")
+    new_id = np.empty(len(order), dtype=np.int64)
+    new_id[order] = np.arange(len(order))
+
+    source = new_id[np.asarray(source, dtype=np.int64)]
+    target = new_id[np.asarray(target, dtype=np.int64)]
+    by_source = np.argsort(source, kind="stable")
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=len(order)), out=offsets[1:])
+
+    arrays = {
+        "lat": lat[order],
+        "lng": lng[order],
+        "cell": cell[order],
+        "offsets": offsets,
+        "targets": target[by_source].astype(np.int32),
+        "length": np.asarray(length_m, dtype=np.float32)[by_source],
+        "duration": np.asarray(duration_s, dtype=np.float32)[by_source],
+    }
+    staging = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), array)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(staging, out_dir)
+
+def build_graph(pbf_path: str, out_dir: str, bbox: Optional[tuple] = None):
+    """Extract the car network (optionally inside bbox = min_lat, min_lng, max_lat, max_lng) from an OSM file"""
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError("Building the offline graph needs the osmium package (pip install osmium)")
+
+    node_ids = {}
+    lats, lngs = [], []
+    source, target, length, duration = [], [], [], []
+
+    def node(n):
+        if n.ref not in node_ids:
+            node_ids[n.ref] = len(lats)
+            lats.append(n.lat)
+            lngs.append(n.lon)
+        return node_ids[n.ref]
+
+    class Handler(osmium.SimpleHandler):
+        def way(self, w):
+            highway = w.tags.get("highway")
+            speed = HIGHWAY_SPEED_KMPH.get(highway)
+            if speed is None or w.tags.get("access") in ("no", "private") or w.tags.get("motor_vehicle") == "no":
+                return
+            oneway = w.tags.get("oneway")
+            implied_oneway = highway == "motorway" or w.tags.get("junction") == "roundabout"
+            forward = oneway != "-1"
+            backward = oneway == "-1" or (oneway not in ("yes", "1", "true") and not implied_oneway)
+            refs = [n for n in w.nodes if n.location.valid()]
+            for a, b in zip(refs, refs[1:]):
+                if bbox and not all(bbox[0] <= n.lat <= bbox[2] and bbox[1] <= n.lon <= bbox[3] for n in (a, b)):
+                    continue
+                meters = routing.calculate_distance((a.lat, a.lon), (b.lat, b.lon)) * 1000.0
+                seconds = meters / (speed / 3.6)
+                u, v = node(a), node(b)
+                if forward:
+                    source.append(u); target.append(v); length.append(meters); duration.append(seconds)
+                if backward:
+                    source.append(v); target.append(u); length.append(meters); duration.append(seconds)
+
+    Handler().apply_file(pbf_path, locations=True)
+    print(f"Offline graph: {len(lats)} nodes, {len(source)} edges")
+    write_graph(out_dir, lats, lngs, source, target, length, duration)
+
+class OfflineGraph:
+    """Memory-mapped CSR road graph with node snapping and A* legs"""
+    def __init__(self, path: str):
+        for name in GRAPH_ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.lat)
+
+    def snap(self, lat: float, lng: float) -> Optional[int]:
+        """Nearest road node within SNAP_MAX_KM, or None"""
+        key = int(_cell_keys(lat, lng))
+        ranges = []
+        for row_step in (-100000, 0, 100000):
+            lo = np.searchsorted(self.cell, key + row_step - 1, side="left")
+            hi = np.searchsorted(self.cell, key + row_step + 1, side="right")
+            if hi > lo:
+                ranges.append(np.arange(lo, hi))
+        if not ranges:
+            return None
+        candidates = np.concatenate(ranges)
+        coords = np.stack((self.lat[candidates], self.lng[candidates]), axis=1)
+        dist = routing.distance_matrix([(lat, lng)], coords)[0]
+        best = int(np.argmin(dist))
+        if dist[best] > SNAP_MAX_KM:
+            return None
+        return int(candidates[best])
+
+    def shortest_path(self, source: int, target: int):
+        """(node list, metres, seconds) by A* on travel time, or None if unreachable"""
+        if source == target:
+            return [source], 0.0, 0.0
+        lat, lng, offsets, targets, duration = self.lat, self.lng, self.offsets, self.targets, self.duration
+        target_lat, target_lng = float(lat[target]), float(lng[target])
+        cos_lat = math.cos(math.radians(target_lat))
+        # Seconds per degree at the top speed; equirectangular distance keeps it cheap
+        seconds_per_deg = 0.99 * KM_PER_DEG_LAT * 3600.0 / MAX_SPEED_KMPH
+
+        def estimate(n):
+            dlat = float(lat[n]) - target_lat
+            dlng = (float(lng[n]) - target_lng) * cos_lat
+            return math.sqrt(dlat * dlat + dlng * dlng) * seconds_per_deg
+
+        best = {source: 0.0}
+        parent = {source: (-1, -1)}
+        settled = set()
+        heap = [(estimate(source), 0.0, source)]
+        while heap:
+            _, cost, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            if u == target:
+                break
+            settled.add(u)
+            if len(settled) > MAX_SETTLED_NODES:
+                return None
+            start, end = int(offsets[u]), int(offsets[u + 1])
+            for e, (v, seconds) in enumerate(zip(targets[start:end].tolist(), duration[start:end].tolist()), start):
+                candidate = cost + seconds
+                if candidate < best.get(v, math.inf):
+                    best[v] = candidate
+                    parent[v] = (u, e)
+                    heapq.heappush(heap, (candidate + estimate(v), candidate, v))
+        else:
+            return None
+
+        path, meters = [target], 0.0
+        node = target
+        while node != source:
+            node, e = parent[node]
+            meters += float(self.length[e])
+            path.append(node)
+        path.reverse()
+        return path, meters, best[target]
+
+    def leg(self, a: tuple, b: tuple) -> Optional[dict]:
+        """Road leg in route_editor's leg format (metres, milliseconds, [lng, lat] coordinates), or None"""
+        u, v = self.snap(*a), self.snap(*b)
+        if u is None or v is None:
+            return None
+        found = self.shortest_path(u, v)
+        if found is None:
+            return None
+        path, meters, seconds = found
+        # Straight hops between the stops and their snapped nodes
+        access_km = routing.calculate_distance(a, (float(self.lat[u]), float(self.lng[u]))) + \
+            routing.calculate_distance(b, (float(self.lat[v]), float(self.lng[v])))
+        coordinates = [[a[1], a[0]]] + [[float(self.lng[n]), float(self.lat[n])] for n in path] + [[b[1], b[0]]]
+        return {
+            "distance": meters + access_km * 1000.0,
+            "time": (seconds + access_km / ACCESS_SPEED_KMPH * 3600.0) * 1000.0,
+            "coordinates": coordinates,
+        }
+
+_graph = None
+_graph_lock = threading.Lock()
+
+def get_graph() -> Optional[OfflineGraph]:
+    """The offline graph, loaded on first use; None if it has not been built"""
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None and os.path.exists(os.path.join(OFFLINE_GRAPH_DIR, "offsets.npy")):
+                try:
+                    _graph = OfflineGraph(OFFLINE_GRAPH_DIR)
+                except Exception as e:
+                    print(f"Error loading offline road graph: {e}")
+    return _graph
+
+def leg(a: tuple, b: tuple) -> Optional[dict]:
+    graph = get_graph()
+    return graph.leg(a, b) if graph is not None else None
+
+def route(ordered_points: list) -> Optional[dict]:
+    """Route over ordered_points in get_optimized_route's format, or None if any leg cannot be routed"""
+    if get_graph() is None or len(ordered_points) < 2:
+        return None
+    distance, duration, coordinates = 0.0, 0.0, []
+    for a, b in zip(ordered_points, ordered_points[1:]):
+        found = leg(tuple(a), tuple(b))
+        if found is None:
+            return None
+        distance += found["distance"]
+        duration += found["time"]
+        coordinates.extend(found["coordinates"][1:] if coordinates else found["coordinates"])
+    return {
+        "distance": distance,
+        "time": duration,
+        "points": {"type": "LineString", "coordinates": coordinates},
+        "ordered_points": ordered_points,
+        "offline": True,
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the offline fallback road graph from an OSM extract")
+    parser.add_argument("pbf")
+    parser.add_argument("out_dir", nargs="?", default=OFFLINE_GRAPH_DIR)
+    parser.add_argument("--bbox", help="min_lat,min_lng,max_lat,max_lng")
+    args = parser.parse_args()
+    build_graph(args.pbf, args.out_dir, tuple(float(x) for x in args.bbox.split(",")) if args.bbox else None)
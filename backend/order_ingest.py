@@ -0,0 +1,130 @@
+"""
+Bulk order ingestion. Rows arrive as a JSON array or as a streamed CSV /
+NDJSON body, are validated against schemas.OrderCreate in chunks and each
+chunk's valid rows go in with one multi-row INSERT and one commit. Invalid
+rows are reported by their 1-based position and never block the rest.
+"""
+import codecs
+import csv
+import json
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models, schemas
+from order_stats import stats
+
+INGEST_CHUNK_ROWS = 2000
+# Keep the response small when a whole file is malformed
+MAX_REPORTED_ERRORS = 1000
+
+async def _lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decoded text lines (endings stripped) from a byte stream, BOM tolerated"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in stream:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+async def csv_rows(stream: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    """Rows of a CSV body with a header line, as dicts; empty cells are treated as missing"""
+    record, quotes = [], 0
+    header = None
+    async for line in _lines(stream):
+        # A record only ends on a line that closes every quote it opened (quoted newlines)
+        record.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        fields = next(csv.reader(["\n".join(record)]), [])
+        record, quotes = [], 0
+        if not any(fields):
+            continue
+        if header is None:
+            header = [f.strip() for f in fields]
+            continue
+        yield {k: v for k, v in zip(header, fields) if v != ""}
+
+async def ndjson_rows(stream: AsyncIterator[bytes]) -> AsyncIterator:
+    """One JSON value per non-blank line; undecodable lines come through as the raw string"""
+    async for line in _lines(stream):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line
+
+async def json_rows(items: list) -> AsyncIterator:
+    """Elements of an already decoded JSON array body"""
+    for row in items:
+        yield row
+
+class IngestResult:
+    def __init__(self):
+        self.received = 0
+        self.created = 0
+        self.ids = []
+        self.errors = []
+        self.failed = 0
+
+    def error(self, row: int, messages: list):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "errors": messages})
+
+    def to_dict(self) -> dict:
+        return {"received": self.received, "created": self.created, "failed": self.failed, "errors": self.errors}
+
+async def _insert_chunk(db: AsyncSession, rows: list) -> list:
+    """Multi-row INSERT of validated order dicts in one transaction; returns the new ids"""
+    if not rows:
+        return []
+    result = await db.execute(insert(models.Order).returning(models.Order.id), rows)
+    ids = result.scalars().all()
+    await db.commit()
+    stats.transition(None, models.OrderStatus.PENDING, count=len(rows))
+    return ids
+
+async def ingest(db: AsyncSession, rows: AsyncIterator) -> IngestResult:
+    """Validate and insert rows chunk by chunk; a failed chunk is reported per row and rolled back"""
+    result = IngestResult()
+    chunk, chunk_rows = [], []
+    async for row in rows:
+        result.received += 1
+        if not isinstance(row, dict):
+            result.error(result.received, ["row must be an object"])
+            continue
+        try:
+            order = schemas.OrderCreate(**row)
+        except ValidationError as e:
+            result.error(result.received, [f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()])
+            continue
+        values = order.dict()
+        values["status"] = models.OrderStatus.PENDING
+        chunk.append(values)
+        chunk_rows.append(result.received)
+        if len(chunk) >= INGEST_CHUNK_ROWS:
+            result.created += await _flush(db, chunk, chunk_rows, result)
+            chunk, chunk_rows = [], []
+    result.created += await _flush(db, chunk, chunk_rows, result)
+    return result
+
+async def _flush(db: AsyncSession, chunk: list, chunk_rows: list, result: IngestResult) -> int:
+    try:
+        ids = await _insert_chunk(db, chunk)
+    except Exception as e:
+        await db.rollback()
+        print(f"Error inserting order chunk: {e}")
+        for row in chunk_rows:
+            result.error(row, [f"insert failed: {e.__class__.__name__}"])
+        return 0
+    result.ids.extend(ids)
+    return len(ids)
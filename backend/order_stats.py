@@ -0,0 +1,110 @@
+"""
+Order counts for the dashboards, served from memory. Lifecycle transitions
+in this process adjust the counters as they happen; a background loop
+replaces them with one grouped aggregation every RECONCILE_INTERVAL_SECONDS,
+which also picks up changes made by other workers or directly in the DB.
+"""
+import asyncio
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from sqlalchemy import func, select
+
+import models
+from database import AsyncSessionLocal
+
+RECONCILE_INTERVAL_SECONDS = 60.0
+
+STATUSES = [s.value for s in models.OrderStatus]
+ACTIVE_STATUSES = (models.OrderStatus.ASSIGNED.value, models.OrderStatus.IN_TRANSIT.value)
+
+def _status(value) -> Optional[str]:
+    return getattr(value, "value", value)
+
+class OrderStats:
+    """Per-status counts plus per-rider total / active counts"""
+    def __init__(self):
+        self._status = Counter()
+        self._rider_total = Counter()
+        self._rider_active = Counter()
+        self._lock = threading.Lock()
+        self.reconciled_at = None
+
+    def transition(self, old_status=None, new_status=None, old_rider: Optional[int] = None,
+                   new_rider: Optional[int] = None, count: int = 1):
+        """
+        Record `count` orders moving between (status, rider) states. None as the
+        old status means created, None as the new status means deleted.
+        """
+        old_status, new_status = _status(old_status), _status(new_status)
+        with self._lock:
+            if old_status is not None:
+                self._status[old_status] -= count
+                if old_rider is not None:
+                    self._rider_total[old_rider] -= count
+                    if old_status in ACTIVE_STATUSES:
+                        self._rider_active[old_rider] -= count
+            if new_status is not None:
+                self._status[new_status] += count
+                if new_rider is not None:
+                    self._rider_total[new_rider] += count
+                    if new_status in ACTIVE_STATUSES:
+                        self._rider_active[new_rider] += count
+
+    def replace(self, rows):
+        """Reset from (rider_id, status, count) aggregation rows"""
+        status, total, active = Counter(), Counter(), Counter()
+        for rider_id, order_status, n in rows:
+            status[order_status] += n
+            if rider_id is not None:
+                total[rider_id] += n
+                if order_status in ACTIVE_STATUSES:
+                    active[rider_id] += n
+        with self._lock:
+            self._status, self._rider_total, self._rider_active = status, total, active
+            self.reconciled_at = time.time()
+
+    def totals(self) -> dict:
+        with self._lock:
+            counts = {s: max(self._status[s], 0) for s in STATUSES}
+        return {"total": sum(counts.values()), **counts}
+
+    def rider(self, rider_id: int) -> tuple:
+        """(total orders, active orders) for a rider"""
+        with self._lock:
+            return max(self._rider_total[rider_id], 0), max(self._rider_active[rider_id], 0)
+
+stats = OrderStats()
+
+COUNTS_QUERY = select(models.Order.rider_id, models.Order.status, func.count()).group_by(
+    models.Order.rider_id, models.Order.status
+)
+
+async def reconcile(db=None):
+    """Recount everything in one GROUP BY (rider_id, status) pass over the orders index"""
+    if db is not None:
+        rows = (await db.execute(COUNTS_QUERY)).all()
+    else:
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(COUNTS_QUERY)).all()
+    stats.replace(rows)
+
+async def _reconcile_loop():
+    while True:
+        try:
+            await reconcile()
+        except Exception as e:
+            print(f"Error reconciling order stats: {e}")
+        await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+
+_tasks = []
+
+def start():
+    _tasks.append(asyncio.create_task(_reconcile_loop()))
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
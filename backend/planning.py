@@ -0,0 +1,189 @@
+"""
+Route-planning inputs loaded in set-based queries. Orders come back as a
+struct of numpy arrays (coordinates, weights, priorities, windows) that the
+dispatch and routing code consume directly; riders come back in the same
+query as their active orders, so a dispatch round costs the same number of
+queries however many riders it touches.
+"""
+from collections import namedtuple
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import routing
+import telemetry
+
+ACTIVE_STATUSES = (models.OrderStatus.ASSIGNED, models.OrderStatus.IN_TRANSIT)
+# Ids per IN (...) list when loading orders by id; stays under the drivers' bind-parameter limits
+ID_CHUNK_ROWS = 5000
+ORDER_COLUMNS = (
+    models.Order.id, models.Order.lat, models.Order.lng, models.Order.weight, models.Order.priority,
+    models.Order.delivery_time_start, models.Order.delivery_time_end, models.Order.status, models.Order.rider_id,
+)
+RIDER_COLUMNS = (
+    models.User.id, models.User.name, models.User.current_lat, models.User.current_lng,
+    models.User.capacity, models.User.status,
+)
+Rider = namedtuple("Rider", "id name current_lat current_lng capacity status")
+
+class OrderArrays:
+    """Orders as parallel arrays; records() turns (a subset of) them back into solver dicts"""
+    def __init__(self, rows: list):
+        self.ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.coords = np.array([(r[1], r[2]) for r in rows], dtype=np.float64).reshape(-1, 2)
+        self.weight = np.array([r[3] if r[3] is not None else 1.0 for r in rows], dtype=np.float64)
+        self.priority = np.array([r[4] or 1 for r in rows], dtype=np.int64)
+        self.window_start = [r[5] for r in rows]
+        self.window_end = [r[6] for r in rows]
+        self.status = np.array([r[7] or "" for r in rows], dtype=object)
+        self.rider_ids = np.array([r[8] if r[8] is not None else -1 for r in rows], dtype=np.int64)
+
+    @classmethod
+    def from_records(cls, orders: list) -> "OrderArrays":
+        return cls([
+            (o['id'], o['lat'], o['lng'], o.get('weight'), o.get('priority'),
+             o.get('delivery_time_start'), o.get('delivery_time_end'), o.get('status'), o.get('rider_id'))
+            for o in orders
+        ])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def ready(self, plan_start: datetime) -> np.ndarray:
+        """Window starts in minutes after plan_start (-inf when open)"""
+        return np.array([routing._to_minutes(t, plan_start) if t else -np.inf for t in self.window_start],
+                        dtype=np.float64)
+
+    def due(self, plan_start: datetime) -> np.ndarray:
+        """Window ends in minutes after plan_start (inf when open)"""
+        return np.array([routing._to_minutes(t, plan_start) if t else np.inf for t in self.window_end],
+                        dtype=np.float64)
+
+    def records(self, idx=None) -> list:
+        """Order dicts in the shape the solvers and route cache take"""
+        idx = range(len(self.ids)) if idx is None else idx
+        return [
+            {
+                'id': int(self.ids[i]),
+                'lat': float(self.coords[i, 0]),
+                'lng': float(self.coords[i, 1]),
+                'priority': int(self.priority[i]),
+                'weight': float(self.weight[i]),
+                'delivery_time_start': self.window_start[i],
+                'delivery_time_end': self.window_end[i],
+            }
+            for i in idx
+        ]
+
+class PlanInput:
+    """
+    Riders plus their active orders. Rider rows keep the DB columns (id, name,
+    current_lat, current_lng, capacity, status); the arrays hold each rider's
+    live position (telemetry first, NaN if unknown), capacity and on-board load.
+    """
+    def __init__(self, riders: list, orders: OrderArrays):
+        self.riders = riders
+        self.orders = orders
+        self.rider_ids = np.array([r.id for r in riders], dtype=np.int64)
+        self.capacity = np.array([r.capacity or 10.0 for r in riders], dtype=np.float64)
+        positions = []
+        for r in riders:
+            position = telemetry.store.position(r.id)
+            if position is None and r.current_lat and r.current_lng:
+                position = (r.current_lat, r.current_lng)
+            positions.append(position or (np.nan, np.nan))
+        self.coords = np.array(positions, dtype=np.float64).reshape(-1, 2)
+        self._index = {rid: i for i, rid in enumerate(self.rider_ids.tolist())}
+
+        # Orders arrive grouped by rider: offsets[i]:offsets[i + 1] are rider i's
+        owner = np.array([self._index[rid] for rid in orders.rider_ids.tolist()], dtype=np.int64)
+        self.offsets = np.zeros(len(riders) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owner, minlength=len(riders)), out=self.offsets[1:])
+        self.load = np.bincount(owner, weights=orders.weight, minlength=len(riders))
+
+    def rider(self, rider_id: int):
+        i = self._index.get(rider_id)
+        return self.riders[i] if i is not None else None
+
+    def position(self, rider_id: int) -> Optional[tuple]:
+        """Live (lat, lng) of a rider, or None"""
+        i = self._index.get(rider_id)
+        if i is None or np.isnan(self.coords[i, 0]):
+            return None
+        return float(self.coords[i, 0]), float(self.coords[i, 1])
+
+    def order_indices(self, rider_id: int, statuses=None) -> np.ndarray:
+        i = self._index.get(rider_id)
+        if i is None:
+            return np.empty(0, dtype=np.int64)
+        idx = np.arange(self.offsets[i], self.offsets[i + 1])
+        if statuses is not None:
+            # list membership: str-valued enums compare equal to their stored strings but hash differently
+            wanted = list(statuses)
+            idx = idx[np.array([s in wanted for s in self.orders.status[idx]], dtype=bool)]
+        return idx
+
+    def orders_of(self, rider_id: int, statuses=None) -> list:
+        """Solver dicts for a rider's loaded orders, optionally only some statuses"""
+        return self.orders.records(self.order_indices(rider_id, statuses))
+
+    def vehicles(self) -> list:
+        """Riders with a known position, in dispatch/solve_vrp's vehicle format"""
+        return [
+            {'id': int(self.rider_ids[i]), 'lat': float(self.coords[i, 0]), 'lng': float(self.coords[i, 1]),
+             'capacity': float(self.capacity[i]), 'load': float(self.load[i])}
+            for i in range(len(self.riders)) if not np.isnan(self.coords[i, 0])
+        ]
+
+def orders_query(*criteria):
+    """The select load_orders runs"""
+    return select(*ORDER_COLUMNS).filter(*criteria).order_by(models.Order.id)
+
+async def load_orders(db: AsyncSession, *criteria) -> OrderArrays:
+    """Orders matching criteria (e.g. Order.status == PENDING) as arrays, one query"""
+    result = await db.execute(orders_query(*criteria))
+    return OrderArrays(result.all())
+
+async def load_orders_by_id(db: AsyncSession, ids: list, *criteria) -> OrderArrays:
+    """Orders with the given ids (and matching criteria) as arrays, one query per ID_CHUNK_ROWS ids"""
+    rows = []
+    for i in range(0, len(ids), ID_CHUNK_ROWS):
+        result = await db.execute(
+            select(*ORDER_COLUMNS)
+            .filter(models.Order.id.in_(ids[i:i + ID_CHUNK_ROWS]), *criteria)
+            .order_by(models.Order.id)
+        )
+        rows.extend(result.all())
+    return OrderArrays(rows)
+
+def plan_input_query(rider_ids: Optional[list] = None, statuses=ACTIVE_STATUSES, rider_criteria: tuple = ()):
+    """The LEFT JOIN select load_plan_input runs"""
+    query = (
+        select(*RIDER_COLUMNS, *ORDER_COLUMNS)
+        .select_from(models.User)
+        .outerjoin(models.Order, and_(models.Order.rider_id == models.User.id, models.Order.status.in_(statuses)))
+    )
+    if rider_ids is not None:
+        query = query.filter(models.User.id.in_(rider_ids))
+    else:
+        query = query.filter(models.User.role.ilike('rider'))
+    return query.filter(*rider_criteria).order_by(models.User.id, models.Order.id)
+
+async def load_plan_input(db: AsyncSession, rider_ids: Optional[list] = None, statuses=ACTIVE_STATUSES,
+                          rider_criteria: tuple = ()) -> PlanInput:
+    """
+    Riders (the given ids, else every rider matching rider_criteria) together
+    with their orders in `statuses`, in one LEFT JOIN query.
+    """
+    riders, order_rows = [], []
+    width = len(RIDER_COLUMNS)
+    for row in (await db.execute(plan_input_query(rider_ids, statuses, rider_criteria))).all():
+        if not riders or riders[-1].id != row[0]:
+            riders.append(Rider(*row[:width]))
+        if row[width] is not None:
+            order_rows.append(tuple(row[width:]))
+    return PlanInput(riders, OrderArrays(order_rows))
@@ -0,0 +1,234 @@
+"""
+Road distance/time matrix service with a persistent LRU + TTL cache.
+Coordinates are snapped to COORD_PRECISION decimals to form cache keys, so
+repeat addresses in the delivery area resolve without a GraphHopper call.
+Missing pairs come from the /route endpoint of the self-hosted server (the
+Matrix API is only part of hosted GraphHopper; set GRAPHHOPPER_MATRIX_URL to
+use a matrix-capable backend instead).
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+import routing
+from graphhopper_client import client, GraphHopperUnavailable
+
+GRAPHHOPPER_MATRIX_URL = os.getenv("GRAPHHOPPER_MATRIX_URL")
+# Pairs fetched from /route per get_road_matrix call, shortest first; the rest are estimated this time round
+MATRIX_ROUTE_MAX_PAIRS = int(os.getenv("MATRIX_ROUTE_MAX_PAIRS", "2000"))
+MATRIX_CACHE_PATH = os.getenv("MATRIX_CACHE_PATH", os.path.join(os.path.dirname(__file__), "road_matrix_cache.json"))
+MATRIX_CACHE_MAX_ENTRIES = int(os.getenv("MATRIX_CACHE_MAX_ENTRIES", "500000"))
+MATRIX_CACHE_TTL_SECONDS = int(os.getenv("MATRIX_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+MATRIX_CACHE_SAVE_INTERVAL = 30.0
+
+# ~1.1 m at the equator: close enough to treat as the same address
+COORD_PRECISION = 5
+# Straight-line -> road distance factor used when GraphHopper is unavailable
+DETOUR_FACTOR = 1.3
+
+def snap(point) -> tuple:
+    """Round (lat, lng) to the cache key precision"""
+    return (round(float(point[0]), COORD_PRECISION), round(float(point[1]), COORD_PRECISION))
+
+class MatrixCache:
+    """
+    Bounded LRU cache of (from, to) -> (distance_m, time_s) with TTL expiry,
+    persisted to a JSON file so entries survive restarts.
+    """
+    def __init__(self, path: Optional[str] = MATRIX_CACHE_PATH, max_entries: int = MATRIX_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = MATRIX_CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, origin: tuple, destination: tuple):
+        """(distance_m, time_s) for a snapped pair, or None when missing or expired"""
+        key = (origin, destination)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[2] > self.ttl_seconds:
+                del self._entries[key]
+                self._dirty = True
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def put(self, origin: tuple, destination: tuple, distance_m: float, time_s: float):
+        key = (origin, destination)
+        with self._lock:
+            self._entries[key] = (distance_m, time_s, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                rows = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable matrix cache {self.path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            # Rows are saved oldest-first, so replaying them restores LRU order
+            for o_lat, o_lng, d_lat, d_lng, distance_m, time_s, stored_at in rows[-self.max_entries:]:
+                if now - stored_at <= self.ttl_seconds:
+                    self._entries[((o_lat, o_lng), (d_lat, d_lng))] = (distance_m, time_s, stored_at)
+
+    def save(self, force: bool = False):
+        """Write the cache to disk if it changed (at most every MATRIX_CACHE_SAVE_INTERVAL unless forced)"""
+        if not self.path or not self._dirty:
+            return
+        if not force and time.monotonic() - self._last_save < MATRIX_CACHE_SAVE_INTERVAL:
+            return
+        with self._lock:
+            rows = [[o[0], o[1], d[0], d[1], dist, t, stored]
+                    for (o, d), (dist, t, stored) in self._entries.items()]
+            self._dirty = False
+            self._last_save = time.monotonic()
+        # Per process, so another process saving the same file cannot interleave with this write
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(rows, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving matrix cache: {e}")
+
+matrix_cache = MatrixCache()
+
+def fetch_matrix(points: list):
+    """
+    Request a full road matrix for points from GRAPHHOPPER_MATRIX_URL in one call.
+    Returns (distances_m, times_s) as nested lists, or None if the request fails.
+    """
+    payload = {
+        "points": [[p[1], p[0]] for p in points],
+        "out_arrays": ["distances", "times"],
+        "profile": "car",
+    }
+    try:
+        response = client.request_sync("POST", GRAPHHOPPER_MATRIX_URL, json=payload)
+        if response.status_code == 200:
+            data = response.json()
+            if "distances" in data and "times" in data:
+                return data["distances"], data["times"]
+        print(f"GraphHopper matrix request to {GRAPHHOPPER_MATRIX_URL} failed with status {response.status_code}; "
+              f"falling back to /route (unset GRAPHHOPPER_MATRIX_URL if the server has no Matrix API)")
+    except Exception as e:
+        print(f"Error connecting to GraphHopper matrix: {e}")
+    return None
+
+def fetch_pair(origin: tuple, destination: tuple):
+    """(distance_m, time_s) for one pair from GraphHopper /route, or None"""
+    params = [("point", f"{origin[0]},{origin[1]}"), ("point", f"{destination[0]},{destination[1]}"),
+              ("profile", "car"), ("calc_points", "false"), ("instructions", "false")]
+    try:
+        response = client.request_sync("GET", routing.GRAPHHOPPER_URL, params=params)
+    except GraphHopperUnavailable:
+        return None
+    except Exception as e:
+        print(f"Error connecting to GraphHopper: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"GraphHopper route request failed with status {response.status_code}")
+        return None
+    paths = response.json().get("paths")
+    if not paths:
+        return None
+    return paths[0]["distance"], paths[0]["time"] / 1000.0
+
+def fetch_pairs(pairs: list) -> dict:
+    """{(origin, destination): (distance_m, time_s)} for the pairs GraphHopper could route, in parallel"""
+    if not pairs:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(client.max_concurrency, len(pairs))) as pool:
+        results = pool.map(lambda pair: fetch_pair(*pair), pairs)
+        return {pair: result for pair, result in zip(pairs, results) if result is not None}
+
+def get_road_matrix(points: list, cache: MatrixCache = None):
+    """
+    Road distance (km) and travel time (minutes) matrices for points.
+    Cached pairs are served from the cache; missing pairs are fetched from
+    GraphHopper (one matrix request if GRAPHHOPPER_MATRIX_URL is set, else up
+    to MATRIX_ROUTE_MAX_PAIRS /route requests, shortest pairs first). Cells
+    GraphHopper did not provide are estimated from straight-line distance and
+    are not cached.
+    """
+    cache = cache if cache is not None else matrix_cache
+    n = len(points)
+    keys = [snap(p) for p in points]
+    dist_km = np.zeros((n, n))
+    time_min = np.zeros((n, n))
+    missing = np.zeros((n, n), dtype=bool)
+
+    for i in range(n):
+        for j in range(n):
+            if i == j or keys[i] == keys[j]:
+                continue
+            hit = cache.get(keys[i], keys[j])
+            if hit is None:
+                missing[i, j] = True
+            else:
+                dist_km[i, j] = hit[0] / 1000.0
+                time_min[i, j] = hit[1] / 60.0
+
+    if missing.any():
+        fetched = {}
+        if GRAPHHOPPER_MATRIX_URL:
+            # Only points that take part in a missing pair go to GraphHopper
+            involved = sorted(set(np.flatnonzero(missing.any(axis=1)).tolist()) |
+                              set(np.flatnonzero(missing.any(axis=0)).tolist()))
+            unique_keys = list(dict.fromkeys(keys[i] for i in involved))
+            result = fetch_matrix(unique_keys)
+            if result is not None:
+                distances, times = result
+                pos = {k: idx for idx, k in enumerate(unique_keys)}
+                for i, j in zip(*np.nonzero(missing)):
+                    a, b = pos[keys[i]], pos[keys[j]]
+                    fetched[(keys[i], keys[j])] = (distances[a][b], times[a][b])
+        if not fetched:
+            straight = routing.distance_matrix(points)
+            pairs = {}
+            for i, j in zip(*np.nonzero(missing)):
+                pairs.setdefault((keys[i], keys[j]), straight[i, j])
+            wanted = sorted(pairs, key=pairs.get)[:MATRIX_ROUTE_MAX_PAIRS]
+            fetched = fetch_pairs(wanted)
+            if len(fetched) < len(pairs):
+                print(f"Road matrix: {len(pairs) - len(fetched)} of {len(pairs)} pairs estimated from straight-line distance")
+
+        for (origin, destination), (distance_m, time_s) in fetched.items():
+            cache.put(origin, destination, distance_m, time_s)
+        if fetched:
+            cache.save()
+
+        fallback = routing.distance_matrix(points) * DETOUR_FACTOR
+        for i, j in zip(*np.nonzero(missing)):
+            hit = fetched.get((keys[i], keys[j]))
+            if hit is None:
+                dist_km[i, j] = fallback[i, j]
+                time_min[i, j] = fallback[i, j] / routing.AVERAGE_SPEED_KMPH * 60.0
+            else:
+                dist_km[i, j] = hit[0] / 1000.0
+                time_min[i, j] = hit[1] / 60.0
+
+    return dist_km, time_min
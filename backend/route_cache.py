@@ -0,0 +1,78 @@
+"""
+Cache of computed rider routes so polling dashboards do not re-run the
+solver and GraphHopper when nothing relevant has changed.
+"""
+import hashlib
+import threading
+import time
+from typing import Optional
+
+# Rider positions are rounded to ~110 m so GPS jitter does not bust the cache
+POSITION_PRECISION = 3
+ROUTE_CACHE_MAX_AGE_SECONDS = 300.0
+
+def orders_fingerprint(orders_data: list) -> str:
+    """Stable digest of the orders that feed a route"""
+    rows = sorted(
+        (o.get('id'), o['lat'], o['lng'], o.get('priority'), o.get('weight'),
+         str(o.get('delivery_time_start')), str(o.get('delivery_time_end')))
+        for o in orders_data
+    )
+    return hashlib.sha1(repr(rows).encode()).hexdigest()
+
+def traffic_fingerprint(traffic_points: list) -> str:
+    return hashlib.sha1(repr(sorted(traffic_points or [])).encode()).hexdigest()
+
+def route_key(rider_id: int, orders_data: list, rider_lat: Optional[float], rider_lng: Optional[float],
+              traffic_points: list = None, capacity: float = 10.0, road_costs: bool = False) -> str:
+    """
+    Cache key (also used as the ETag and as the stored route's fingerprint) for
+    a rider's route: the routed orders, coarse rider position, the traffic set
+    in effect and the solve options. Every writer of the routes table keys with
+    this, so a route stored by a reroute is served to /optimize for the same inputs.
+    """
+    position = None
+    if rider_lat is not None and rider_lng is not None:
+        position = (round(rider_lat, POSITION_PRECISION), round(rider_lng, POSITION_PRECISION))
+    parts = (
+        rider_id,
+        orders_fingerprint(orders_data),
+        position,
+        traffic_fingerprint(traffic_points),
+        float(capacity),
+        bool(road_costs),
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+class RouteCache:
+    """Latest route per rider, tagged with the key it was computed for"""
+    def __init__(self, max_age_seconds: float = ROUTE_CACHE_MAX_AGE_SECONDS):
+        self.max_age_seconds = max_age_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, rider_id: int, key: str):
+        """Cached route for rider_id if it was computed for key and is still fresh"""
+        with self._lock:
+            entry = self._entries.get(rider_id)
+        if entry is None or entry[0] != key:
+            return None
+        if time.monotonic() - entry[2] > self.max_age_seconds:
+            return None
+        return entry[1]
+
+    def put(self, rider_id: int, key: str, route: dict):
+        with self._lock:
+            self._entries[rider_id] = (key, route, time.monotonic())
+
+    def invalidate(self, rider_id: Optional[int]):
+        if rider_id is None:
+            return
+        with self._lock:
+            self._entries.pop(rider_id, None)
+
+    def invalidate_all(self):
+        with self._lock:
+            self._entries.clear()
+
+route_cache = RouteCache()
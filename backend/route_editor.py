@@ -0,0 +1,167 @@
+"""
+Incremental route editing: keeps each rider's current stop sequence, inserts
+new orders by cheapest feasible insertion, repairs locally after removals and
+re-queries GraphHopper only for legs that are not already known.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+
+import routing
+from graphhopper_client import client
+from road_matrix import snap
+
+LEG_CACHE_SIZE = 20000
+
+class RouteEditor:
+    """In-process stop sequences per rider plus an LRU of GraphHopper legs"""
+    def __init__(self, leg_cache_size: int = LEG_CACHE_SIZE):
+        self.leg_cache_size = leg_cache_size
+        self._routes = {}  # rider_id -> list of order dicts in visiting order
+        self._legs = OrderedDict()  # (snapped from, snapped to) -> leg dict
+        self._locks = {}
+
+    def sequence(self, rider_id: int) -> Optional[list]:
+        return self._routes.get(rider_id)
+
+    def forget(self, rider_id: Optional[int]):
+        self._routes.pop(rider_id, None)
+
+    def seed(self, rider_id: int, seq: list):
+        """Adopt a sequence computed elsewhere (e.g. a fleet plan) as the rider's current route"""
+        self._routes[rider_id] = list(seq)
+
+    def apply(self, rider_id: int, start: tuple, orders_data: list, rider_capacity: float = 10.0) -> bool:
+        """
+        Bring the stored sequence in line with orders_data (the rider's current
+        orders, each with an 'id'). Removed orders are dropped and the route is
+        repaired locally, new ones are inserted where they cost least. Returns
+        False if some order could not be placed within capacity/time windows.
+        """
+        current = self._routes.get(rider_id)
+        by_id = {o['id']: o for o in orders_data}
+
+        if current is None:
+            self._routes[rider_id], feasible = self._initial_sequence(start, orders_data, rider_capacity)
+            return feasible
+
+        # Keep the known order, refreshed with the latest order data
+        kept = [by_id[o['id']] for o in current if o['id'] in by_id]
+        if len(kept) < len(current):
+            kept = routing.repair_route(start, kept, rider_capacity)
+
+        feasible = True
+        known = {o['id'] for o in kept}
+        added = [o for o in orders_data if o['id'] not in known]
+        for order in sorted(added, key=lambda o: -(o.get('priority') or 1)):
+            pos, ok = routing.insert_into_route(start, kept, order, rider_capacity)
+            kept.insert(pos, order)
+            feasible = feasible and ok
+
+        self._routes[rider_id] = kept
+        return feasible
+
+    def _initial_sequence(self, start: tuple, orders_data: list, rider_capacity: float):
+        """Full solve for a rider we have no sequence for yet: (sequence, feasible)"""
+        vehicle = {'id': 0, 'lat': start[0], 'lng': start[1], 'capacity': rider_capacity}
+        plan = routing.solve_vrp(orders_data, [vehicle], time_limit=0.05)
+        seq = plan["routes"][0]["orders"] if plan["routes"] else []
+        # Orders that break capacity/windows are still the rider's: place them as cheaply as possible
+        for order in plan["unassigned"]:
+            pos, _ = routing.insert_into_route(start, seq, order, rider_capacity)
+            seq.insert(pos, order)
+        return seq, not plan["unassigned"]
+
+    async def _fetch_leg(self, a: tuple, b: tuple):
+        """Road leg between two points, or None if GraphHopper could not provide it"""
+        params = [("point", f"{a[0]},{a[1]}"), ("point", f"{b[0]},{b[1]}"),
+                  ("points_encoded", "false"), ("profile", "car")]
+        try:
+            response = await client.request("GET", routing.GRAPHHOPPER_URL, params=params)
+            if response.status_code == 200:
+                data = response.json()
+                if data.get("paths"):
+                    path = data["paths"][0]
+                    return {
+                        "distance": path["distance"],
+                        "time": path["time"],
+                        "coordinates": path["points"]["coordinates"],
+                    }
+        except Exception as e:
+            print(f"Error fetching route leg from GraphHopper: {e}")
+        return None
+
+    async def build_route(self, start: tuple, seq: list) -> dict:
+        """Stitch a route from per-leg results, querying only legs not already cached"""
+        points = [start] + [(o['lat'], o['lng']) for o in seq]
+        keys = [(snap(points[i]), snap(points[i + 1])) for i in range(len(points) - 1)]
+
+        missing = [k for k in dict.fromkeys(keys) if k not in self._legs]
+        fetched = await asyncio.gather(*(self._fetch_leg(a, b) for a, b in missing))
+        for key, leg in zip(missing, fetched):
+            if leg is not None:
+                self._legs[key] = leg
+                while len(self._legs) > self.leg_cache_size:
+                    self._legs.popitem(last=False)
+
+        # Legs GraphHopper could not provide come from the offline graph; they are
+        # not cached so GraphHopper's version replaces them once it is back
+        offline = {}
+        unrouted = [i for i, key in enumerate(keys) if key not in self._legs]
+        if unrouted:
+            import offline_router
+            legs = await asyncio.to_thread(lambda: [offline_router.leg(points[i], points[i + 1]) for i in unrouted])
+            offline = {i: leg for i, leg in zip(unrouted, legs) if leg is not None}
+
+        distance = 0
+        duration = 0
+        coordinates = []
+        straight_line = False
+        for i, key in enumerate(keys):
+            leg = self._legs.get(key) or offline.get(i)
+            if leg is None:
+                straight_line = True
+                # Fallback to a straight line for this leg only
+                leg_coordinates = [[points[i][1], points[i][0]], [points[i + 1][1], points[i + 1][0]]]
+            else:
+                if key in self._legs:
+                    self._legs.move_to_end(key)
+                distance += leg["distance"]
+                duration += leg["time"]
+                leg_coordinates = leg["coordinates"]
+            # Consecutive legs share their joint point
+            coordinates.extend(leg_coordinates[1:] if coordinates else leg_coordinates)
+
+        route = {
+            "distance": distance,
+            "time": duration,
+            "points": {"type": "LineString", "coordinates": coordinates},
+            "ordered_points": points,
+            "order_ids": [o['id'] for o in seq],
+        }
+        # Same tags as routing's fallbacks, so callers do not store a partly degraded route
+        if offline:
+            route["offline"] = True
+        if straight_line:
+            route["straight_line"] = True
+        return route
+
+    async def update(self, rider_id: int, start: Optional[tuple], orders_data: list, rider_capacity: float = 10.0):
+        """
+        Apply an order change for rider_id and return the stitched route.
+        Without a known rider position there is no fixed start, so this falls
+        back to a full get_optimized_route over the order points.
+        """
+        if start is None:
+            self.forget(rider_id)
+            points = [(o['lat'], o['lng']) for o in orders_data]
+            return await routing.get_optimized_route_async(points, orders_data, rider_capacity)
+
+        lock = self._locks.setdefault(rider_id, asyncio.Lock())
+        async with lock:
+            feasible = await asyncio.to_thread(self.apply, rider_id, start, orders_data, rider_capacity)
+            route = await self.build_route(start, self._routes[rider_id])
+        route["feasible"] = feasible
+        return route
+
+editor = RouteEditor()
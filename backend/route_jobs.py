@@ -0,0 +1,184 @@
+"""
+Background route re-optimization. Endpoints submit a job instead of awaiting
+the solver and GraphHopper; jobs with the same key submitted within the
+debounce window collapse into one run (a key that keeps being resubmitted
+still starts within MAX_DEBOUNCE_SECONDS), and jobs for a key never run
+concurrently. A fixed pool of workers bounds how many solves run at once,
+and job status changes are pushed to the rider's WebSocket topic.
+"""
+import asyncio
+import time
+import uuid
+from typing import Awaitable, Callable, Hashable, Optional
+
+WORKER_COUNT = 4
+# Anytime improvement jobs hold a worker for their whole budget, so they get their own, smaller pool
+ANYTIME_WORKER_COUNT = 2
+DEBOUNCE_SECONDS = 0.5
+MAX_DEBOUNCE_SECONDS = 2.0
+JOB_RETENTION_SECONDS = 600.0
+
+class RouteJob:
+    """One (possibly coalesced) unit of routing work"""
+    def __init__(self, key: Hashable, run: Callable[[], Awaitable], rider_id: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.run = run
+        self.rider_id = rider_id
+        self.status = "queued"  # queued -> running -> done | failed
+        self.result = None
+        self.error = None
+        self.requests = 1  # submissions folded into this job
+        self.created_at = time.time()
+        self.finished_at = None
+        self.due = 0.0
+        self.latest_due = 0.0
+        self.done = asyncio.Event()
+
+    def to_dict(self, include_result: bool = True) -> dict:
+        data = {
+            "job_id": self.id,
+            "rider_id": self.rider_id,
+            "status": self.status,
+            "requests": self.requests,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+class RouteJobQueue:
+    def __init__(self, workers: int = WORKER_COUNT, debounce_seconds: float = DEBOUNCE_SECONDS,
+                 retention_seconds: float = JOB_RETENTION_SECONDS, max_debounce_seconds: float = MAX_DEBOUNCE_SECONDS):
+        self.workers = workers
+        self.debounce_seconds = debounce_seconds
+        self.max_debounce_seconds = max_debounce_seconds
+        self.retention_seconds = retention_seconds
+        self.manager = None
+        self._jobs = {}     # job id -> RouteJob
+        self._pending = {}  # key -> RouteJob still inside its debounce window
+        self._running = {}  # key -> RouteJob handed to the workers
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._releases = set()  # debounce tasks; asyncio keeps only weak references to tasks
+
+    def start(self, manager=None):
+        if manager is not None:
+            self.manager = manager
+        if self._ready is not None:
+            return
+        self._ready = asyncio.Queue()
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        tasks = self._tasks + list(self._releases)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._releases.clear()
+        self._pending.clear()
+        self._ready = None
+
+    def get(self, job_id: str) -> Optional[RouteJob]:
+        return self._jobs.get(job_id)
+
+    def submit(self, key: Hashable, run: Callable[[], Awaitable], rider_id: Optional[int] = None,
+               delay: Optional[float] = None, share_running: bool = False) -> RouteJob:
+        """
+        Queue run() under key after delay seconds (default: the debounce window).
+        If a job for key is still waiting, it is reused: the latest run replaces
+        the old one and its start is pushed back, but never past
+        max_debounce_seconds after the job was first queued.
+        share_running: the key captures every input of run(), so a job already
+        running for it gives the same answer and is returned instead.
+        """
+        self.start()
+        self._prune()
+        delay = self.debounce_seconds if delay is None else delay
+        if share_running:
+            job = self._running.get(key)
+            if job is not None:
+                job.requests += 1
+                return job
+        job = self._pending.get(key)
+        if job is not None:
+            job.run = run
+            job.requests += 1
+            job.due = min(max(job.due, time.monotonic() + delay), job.latest_due)
+            return job
+
+        job = RouteJob(key, run, rider_id)
+        job.due = time.monotonic() + delay
+        job.latest_due = job.due + max(self.max_debounce_seconds - delay, 0.0)
+        self._jobs[job.id] = job
+        self._pending[key] = job
+        task = asyncio.create_task(self._release(job))
+        self._releases.add(task)
+        task.add_done_callback(self._releases.discard)
+        return job
+
+    async def wait(self, job: RouteJob, timeout: Optional[float] = None) -> RouteJob:
+        await asyncio.wait_for(job.done.wait(), timeout)
+        return job
+
+    async def _release(self, job: RouteJob):
+        """Hand job to the workers once its debounce window and any running job for its key are over"""
+        while True:
+            remaining = job.due - time.monotonic()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+                continue
+            running = self._running.get(job.key)
+            if running is None:
+                break
+            await running.done.wait()
+        # From here on a new submit for this key starts a new job
+        if self._pending.get(job.key) is job:
+            del self._pending[job.key]
+        self._running[job.key] = job
+        await self._ready.put(job)
+
+    async def _worker(self):
+        while True:
+            job = await self._ready.get()
+            job.status = "running"
+            try:
+                job.result = await job.run()
+                job.status = "done"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                print(f"Route job {job.id} ({job.key}) failed: {e}")
+            finally:
+                job.finished_at = time.time()
+                if self._running.get(job.key) is job:
+                    del self._running[job.key]
+                job.done.set()
+            await self._notify(job)
+
+    async def _notify(self, job: RouteJob):
+        if self.manager is None or job.rider_id is None:
+            return
+        try:
+            await self.manager.publish_rider(job.rider_id, {
+                "type": "route_job",
+                "data": job.to_dict(include_result=False)
+            })
+        except Exception as e:
+            print(f"Error publishing route job {job.id}: {e}")
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+queue = RouteJobQueue()
+anytime_queue = RouteJobQueue(workers=ANYTIME_WORKER_COUNT)
@@ -1,11 +1,21 @@
-import requests
 import json
 import math
+import numpy as np
+import time
 from datetime import datetime, timedelta
 from typing import List, Tuple, Optional
 
 GRAPHHOPPER_URL = "http://localhost:8989/route"
 
+# Travel model used by the VRP solver when no road times are available
+AVERAGE_SPEED_KMPH = 20.0
+SERVICE_TIME_MIN = 3.0
+# Weight of (priority * arrival minute) against kilometres in the VRP objective
+VRP_PRIORITY_WEIGHT = 0.01
+VRP_EPSILON = 1e-9
+# Rider loads up to this many stops are sequenced exactly (Held-Karp), larger ones greedily
+EXACT_TSP_MAX_STOPS = 12
+
 def calculate_distance(p1, p2):
     """Haversine distance in km"""
     lat1, lon1 = p1
@@ -17,34 +27,98 @@ def calculate_distance(p1, p2):
     c = 2 * math.asin(math.sqrt(a))
     return R * c
 
+EARTH_RADIUS_KM = 6371.0
+
+def distance_matrix(origins, destinations=None) -> np.ndarray:
+    """
+    Haversine distances in km between every origin and every destination.
+    origins/destinations: sequences or (N, 2) arrays of (lat, lng).
+    destinations defaults to origins. Returns an (N, M) float64 array.
+    """
+    a = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+    b = a if destinations is None else np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+
+    lat1 = np.radians(a[:, 0])[:, None]
+    lng1 = np.radians(a[:, 1])[:, None]
+    lat2 = np.radians(b[:, 0])[None, :]
+    lng2 = np.radians(b[:, 1])[None, :]
+
+    h = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) * 0.5) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+def encode_polyline(coordinates: list, precision: int = 5) -> str:
+    """Google encoded polyline for GeoJSON-ordered [lng, lat] coordinates"""
+    factor = 10 ** precision
+    result = []
+    prev_lat = prev_lng = 0
+    for lng, lat in coordinates:
+        lat_i = int(round(lat * factor))
+        lng_i = int(round(lng * factor))
+        for delta in (lat_i - prev_lat, lng_i - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        prev_lat, prev_lng = lat_i, lng_i
+    return "".join(result)
+
+def decode_polyline(encoded: str, precision: int = 5) -> list:
+    """Inverse of encode_polyline: [lng, lat] coordinates"""
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = value = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                value |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(value >> 1) if value & 1 else value >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append([lng / factor, lat / factor])
+    return coordinates
+
 def cluster_orders_by_proximity(orders: list, max_distance_km: float = 5.0) -> List[List]:
     """
     Group orders within max_distance_km radius using simple clustering.
+    An order joins a cluster when it is within max_distance_km of any member.
     Returns list of order clusters.
     """
     if not orders:
         return []
     
+    from spatial import GridIndex
+    # A zero or negative radius only groups identical points; keep the grid cells positive
+    index = GridIndex([(o['lat'], o['lng']) for o in orders], cell_km=max(max_distance_km, 1e-3))
+    
     clusters = []
-    unclustered = orders.copy()
+    unclustered = np.ones(len(orders), dtype=bool)
     
-    while unclustered:
+    for seed in range(len(orders)):
+        if not unclustered[seed]:
+            continue
         # Start new cluster with first unclustered order
-        seed = unclustered.pop(0)
-        cluster = [seed]
+        unclustered[seed] = False
+        members = [seed]
+        frontier = [seed]
         
-        # Find nearby orders
-        i = 0
-        while i < len(unclustered):
-            order = unclustered[i]
-            # Check distance to any order in current cluster
-            if any(calculate_distance((seed['lat'], seed['lng']), (order['lat'], order['lng'])) <= max_distance_km 
-                   for seed in cluster):
-                cluster.append(unclustered.pop(i))
-            else:
-                i += 1
+        # Grow the cluster with every order close to any member
+        while frontier:
+            idx = frontier.pop()
+            nearby = index.query_radius(orders[idx]['lat'], orders[idx]['lng'], max_distance_km)
+            found = nearby[unclustered[nearby]]
+            unclustered[found] = False
+            members.extend(found.tolist())
+            frontier.extend(found.tolist())
         
-        clusters.append(cluster)
+        clusters.append([orders[i] for i in sorted(members)])
     
     return clusters
 
@@ -69,95 +143,248 @@ def calculate_total_weight(orders: list) -> float:
     """Calculate total weight of orders"""
     return sum(o.get('weight', 1.0) for o in orders)
 
-def solve_tsp_with_constraints(points: list, orders_data: list = None, rider_capacity: float = 10.0):
+def solve_tsp_exact(dist_matrix: np.ndarray, priorities: list = None, ready: list = None, due: list = None,
+                    speed_kmph: float = AVERAGE_SPEED_KMPH, service_time_min: float = SERVICE_TIME_MIN):
+    """
+    Held-Karp (bitmask DP) shortest open path from node 0 through every other node.
+    dist_matrix: (n+1, n+1) km, node 0 is the start, nodes 1..n the stops.
+    priorities: every stop is visited after all stops of higher priority.
+    ready / due: optional per-stop minutes after departure; arriving before ready
+    means waiting, arriving after due is not allowed.
+    Returns the visiting order as indices into dist_matrix (starting with 0),
+    or None if no order meets the deadlines. O(2^n * n^2), vectorized per layer.
+    With deadlines a shorter path may arrive too late where a longer one would
+    not, so states then keep every Pareto-optimal (km, clock) label instead.
+    """
+    d = np.asarray(dist_matrix, dtype=np.float64)
+    n = len(d) - 1
+    if n <= 0:
+        return [0]
+    size = 1 << n
+    bits = 1 << np.arange(n, dtype=np.int64)
+    prio = np.asarray(priorities if priorities is not None else [1] * n)
+    ready = np.array([0.0 if r is None else r for r in ready], dtype=np.float64) if ready is not None else np.zeros(n)
+    due = np.array([np.inf if t is None else t for t in due], dtype=np.float64) if due is not None else np.full(n, np.inf)
+    # Bitmask of stops that must already be visited before stop j
+    required = np.array([int(bits[prio > prio[j]].sum()) for j in range(n)], dtype=np.int64)
+
+    minutes_per_km = 60.0 / speed_kmph
+    stop_km = d[1:, 1:]
+    stop_min = stop_km * minutes_per_km + service_time_min
+    first = np.maximum(ready, d[0, 1:] * minutes_per_km)
+    if np.isfinite(due).any():
+        # The optimum without deadlines is also the answer whenever it happens to meet them all
+        relaxed = solve_tsp_exact(d, prio, ready, None, speed_kmph, service_time_min)
+        clock = 0.0
+        for k, (a, b) in enumerate(zip(relaxed, relaxed[1:])):
+            clock = max(ready[b - 1], clock + (service_time_min if k else 0.0) + d[a, b] * minutes_per_km)
+            if clock > due[b - 1]:
+                break
+        else:
+            return relaxed
+        return _tsp_exact_pareto(d[0, 1:], stop_km, stop_min, first, due, ready, required)
+
+    cost = np.full((size, n), np.inf)    # shortest km of a path covering mask and ending at j
+    clock = np.full((size, n), np.inf)   # arrival minute at j along that path
+    parent = np.full((size, n), -1, dtype=np.int64)
+
+    start_ok = (required == 0) & (first <= due)
+    cost[bits[start_ok], np.flatnonzero(start_ok)] = d[0, 1:][start_ok]
+    clock[bits[start_ok], np.flatnonzero(start_ok)] = first[start_ok]
+
+    masks = np.arange(size, dtype=np.int64)
+    popcount = np.zeros(size, dtype=np.int64)
+    for b in bits:
+        popcount += (masks & b) != 0
+
+    for layer in range(1, n):
+        layer_masks = masks[popcount == layer]
+        # (mask, i, j): extend the path covering mask and ending at i with stop j
+        km = cost[layer_masks][:, :, None] + stop_km[None, :, :]
+        arrival = np.maximum(ready[None, None, :], clock[layer_masks][:, :, None] + stop_min[None, :, :])
+        km[arrival > due[None, None, :]] = np.inf
+        best = np.argmin(km, axis=1)
+        m_idx, j_idx = np.nonzero(
+            ((layer_masks[:, None] & bits[None, :]) == 0) &
+            ((layer_masks[:, None] & required[None, :]) == required[None, :])
+        )
+        i_idx = best[m_idx, j_idx]
+        # Each (mask, j) pair produces a distinct (mask | j, j) state
+        target = layer_masks[m_idx] | bits[j_idx]
+        cost[target, j_idx] = km[m_idx, i_idx, j_idx]
+        clock[target, j_idx] = arrival[m_idx, i_idx, j_idx]
+        parent[target, j_idx] = i_idx
+
+    full = size - 1
+    last = int(np.argmin(cost[full]))
+    if not np.isfinite(cost[full, last]):
+        return None
+    path = []
+    mask = full
+    while last >= 0:
+        path.append(last + 1)
+        prev = int(parent[mask, last])
+        mask ^= int(bits[last])
+        last = prev
+    return [0] + path[::-1]
+
+def _tsp_exact_pareto(start_km, stop_km, stop_min, first, due, ready, required):
+    """
+    solve_tsp_exact with deadlines: per (mask, last stop) keep each label
+    (km, arrival clock) that no other label beats on both, so no path that
+    could still meet a later deadline is dropped.
+    """
+    n = len(first)
+    start_km, first, due, ready = start_km.tolist(), first.tolist(), due.tolist(), ready.tolist()
+    stop_km, stop_min, required = stop_km.tolist(), stop_min.tolist(), required.tolist()
+    # (mask, j) -> [(km, clock, j, parent label)]
+    labels = {}
+    for j in range(n):
+        if required[j] == 0 and first[j] <= due[j]:
+            labels[(1 << j, j)] = [(start_km[j], first[j], j, None)]
+
+    for mask in sorted(range(1, 1 << n), key=lambda m: bin(m).count("1")):
+        for i in range(n):
+            state = labels.get((mask, i))
+            if not state:
+                continue
+            for j in range(n):
+                bit = 1 << j
+                if mask & bit or mask & required[j] != required[j]:
+                    continue
+                front = labels.setdefault((mask | bit, j), [])
+                for label in state:
+                    clock = max(ready[j], label[1] + stop_min[i][j])
+                    if clock > due[j]:
+                        continue
+                    km = label[0] + stop_km[i][j]
+                    if any(k <= km and c <= clock for k, c, _, _ in front):
+                        continue
+                    front[:] = [l for l in front if not (km <= l[0] and clock <= l[1])]
+                    front.append((km, clock, j, label))
+
+    full = (1 << n) - 1
+    finals = [label for j in range(n) for label in labels.get((full, j), ())]
+    if not finals:
+        return None
+    label = min(finals, key=lambda l: l[0])
+    path = []
+    while label is not None:
+        path.append(label[2] + 1)
+        label = label[3]
+    return [0] + path[::-1]
+
+def solve_tsp_with_constraints(points: list, orders_data: list = None, rider_capacity: float = 10.0,
+                               dist_matrix: np.ndarray = None):
     """
     TSP with time windows and capacity constraints.
     points: list of (lat, lng). Assumes points[0] is the start (rider).
     orders_data: list of order dicts with priority, weight, time windows
+    dist_matrix: optional precomputed distance_matrix(points)
     Returns: reordered list of points respecting constraints
     """
     if not points or len(points) <= 2:
         return points
     
+    if dist_matrix is None:
+        dist_matrix = distance_matrix(points)
+    
     # If no order data provided, fallback to simple nearest neighbor
     if not orders_data or len(orders_data) != len(points) - 1:
-        return solve_tsp_nearest_neighbor(points)
+        return solve_tsp_nearest_neighbor(points, dist_matrix)
+    
+    # Indices into points of the orders we will visit (+1 because points[0] is rider)
+    candidates = list(range(1, len(points)))
     
     # Check capacity constraint
     total_weight = calculate_total_weight(orders_data)
     if total_weight > rider_capacity:
         # Split into multiple trips (simplified: take first batch that fits)
         cumulative_weight = 0
-        feasible_orders = []
-        for order in sorted(orders_data, key=lambda x: x.get('priority', 1), reverse=True):
-            if cumulative_weight + order.get('weight', 1.0) <= rider_capacity:
-                feasible_orders.append(order)
-                cumulative_weight += order.get('weight', 1.0)
-        
-        # Reconstruct points for feasible orders only
-        points = [points[0]] + [points[orders_data.index(o) + 1] for o in feasible_orders]
-        orders_data = feasible_orders
+        feasible = []
+        for idx in sorted(candidates, key=lambda i: orders_data[i - 1].get('priority', 1), reverse=True):
+            weight = orders_data[idx - 1].get('weight', 1.0)
+            if cumulative_weight + weight <= rider_capacity:
+                feasible.append(idx)
+                cumulative_weight += weight
+        candidates = feasible
     
-    # Sort by priority first, then apply nearest neighbor
-    start = points[0]
-    remaining_indices = list(range(1, len(points)))
+    # Typical loads are small enough to sequence optimally
+    if len(candidates) <= EXACT_TSP_MAX_STOPS:
+        plan_start = datetime.utcnow()
+        nodes = [0] + candidates
+        stops = [orders_data[idx - 1] for idx in candidates]
+        order = solve_tsp_exact(
+            dist_matrix[np.ix_(nodes, nodes)],
+            priorities=[o.get('priority', 1) for o in stops],
+            ready=[_to_minutes(o.get('delivery_time_start'), plan_start) for o in stops],
+            due=[_to_minutes(o.get('delivery_time_end'), plan_start) for o in stops],
+        )
+        if order is not None:
+            return [points[nodes[i]] for i in order]
     
     # Group by priority
     priority_groups = {}
-    for i, order in enumerate(orders_data):
-        priority = order.get('priority', 1)
+    for idx in candidates:
+        priority = orders_data[idx - 1].get('priority', 1)
         if priority not in priority_groups:
             priority_groups[priority] = []
-        priority_groups[priority].append(i + 1)  # +1 because points[0] is rider
+        priority_groups[priority].append(idx)
     
     # Process high priority first, then apply greedy nearest neighbor within each group
-    path = [start]
-    current = start
+    path = [points[0]]
+    current = 0
     
     for priority in sorted(priority_groups.keys(), reverse=True):
-        group_indices = priority_groups[priority]
-        while group_indices:
-            nearest_idx = min(group_indices, key=lambda idx: calculate_distance(current, points[idx]))
-            path.append(points[nearest_idx])
-            current = points[nearest_idx]
-            group_indices.remove(nearest_idx)
+        group_indices = np.array(priority_groups[priority])
+        while len(group_indices):
+            k = int(np.argmin(dist_matrix[current, group_indices]))
+            current = int(group_indices[k])
+            path.append(points[current])
+            group_indices = np.delete(group_indices, k)
     
     return path
 
-def solve_tsp_nearest_neighbor(points):
+def solve_tsp_nearest_neighbor(points, dist_matrix: np.ndarray = None):
     """
     Simple nearest neighbor TSP.
     points: list of (lat, lng). Assumes points[0] is the start (rider).
+    dist_matrix: optional precomputed distance_matrix(points)
     Returns: reordered list of points.
     """
     if not points or len(points) <= 2:
         return points
     
-    start = points[0]
-    to_visit = points[1:]
-    path = [start]
-    current = start
+    if dist_matrix is None:
+        dist_matrix = distance_matrix(points)
+    
+    unvisited = np.ones(len(points), dtype=bool)
+    unvisited[0] = False
+    path = [points[0]]
+    current = 0
     
-    while to_visit:
-        nearest = min(to_visit, key=lambda p: calculate_distance(current, p))
-        path.append(nearest)
-        to_visit.remove(nearest)
-        current = nearest
+    for _ in range(len(points) - 1):
+        row = np.where(unvisited, dist_matrix[current], np.inf)
+        current = int(np.argmin(row))
+        unvisited[current] = False
+        path.append(points[current])
         
     return path
 
-def get_optimized_route(points: list, orders_data: list = None, rider_capacity: float = 10.0, avoid_points: list = None):
-    """
-    points: list of [lat, lng]
-    orders_data: optional list of order dicts with constraints
-    avoid_points: optional list of (lat, lng) to avoid
-    """
-    # First, reorder points using TSP heuristic with constraints
-    ordered_points = solve_tsp_with_constraints(points, orders_data, rider_capacity)
+def order_route_points(points: list, orders_data: list = None, rider_capacity: float = 10.0,
+                       reorder: bool = True, road_costs: bool = False) -> list:
+    """Visiting order for get_optimized_route (TSP heuristic unless reorder is False)"""
+    if not reorder:
+        return list(points)
+    dist_matrix = None
+    if road_costs and len(points) > 2:
+        import road_matrix
+        dist_matrix, _ = road_matrix.get_road_matrix(points)
+    return solve_tsp_with_constraints(points, orders_data, rider_capacity, dist_matrix)
 
+def _route_query(ordered_points: list, avoid_points: list = None) -> list:
+    """GraphHopper /route query parameters as a list of (key, value) pairs"""
     # GraphHopper expects point=lat,lng&point=lat,lng...
-    
-    # Construct query parameters
     params = {
         "points_encoded": "false",
         "profile": "car"
@@ -166,50 +393,581 @@ def get_optimized_route(points: list, orders_data: list = None, rider_capacity:
     # Add avoid points if any
     if avoid_points:
         params["ch.disable"] = "true"
-        # Format: lat,lon,radius (radius in meters)
-        # We'll use a default radius of 200m for traffic avoidance
-        block_areas = [f"{p[0]},{p[1]},200" for p in avoid_points]
-        # GraphHopper might expect multiple block_area params or a specific format
-        # Standard GH uses 'block_area' parameter multiple times
-        # We'll handle this in the query construction below
     
-    # Add points to params. requests handles multiple keys with same name if passed as list of tuples
-    query_points = [("point", f"{p[0]},{p[1]}") for p in ordered_points]
+    # Add points to params. Both HTTP clients handle repeated keys passed as a list of tuples
+    query = [("point", f"{p[0]},{p[1]}") for p in ordered_points]
     
-    # Add block_area params
+    # Standard GH uses 'block_area' parameter multiple times
+    # Format: lat,lon,radius (radius in meters; 200m default for traffic avoidance)
+    # or a rectangle lat1,lon1,lat2,lon2 for merged traffic incidents
     if avoid_points:
         for p in avoid_points:
-            query_points.append(("block_area", f"{p[0]},{p[1]},200"))
+            if len(p) == 4:
+                query.append(("block_area", f"{p[0]:.6f},{p[1]:.6f},{p[2]:.6f},{p[3]:.6f}"))
+            else:
+                query.append(("block_area", f"{p[0]},{p[1]},200"))
+    
+    return query + list(params.items())
+
+def _route_result(data: dict, ordered_points: list):
+    """Route dict from a GraphHopper /route response body, or None if it has no path"""
+    if "paths" in data and len(data["paths"]) > 0:
+        path = data["paths"][0]
+        return {
+            "distance": path["distance"],
+            "time": path["time"],
+            "points": path["points"], # GeoJSON
+            "ordered_points": ordered_points # Return the order for UI if needed
+        }
+    return None
+
+def _straight_line_route(ordered_points: list):
+    """Last-resort route when neither GraphHopper nor the offline graph can route"""
+    return {
+        "distance": 0,
+        "time": 0,
+        "points": {
+            "type": "LineString",
+            "coordinates": [[p[1], p[0]] for p in ordered_points]
+        },
+        "ordered_points": ordered_points,
+        "straight_line": True,
+    }
+
+def is_degraded(route: dict) -> bool:
+    """True for fallback routes (offline graph or straight lines) that must not be cached as the answer"""
+    return bool(route.get("offline") or route.get("straight_line"))
 
+def _fallback_route(ordered_points: list):
+    """Route from the offline road graph while GraphHopper is unreachable, else straight lines"""
+    import offline_router
     try:
-        response = requests.get(GRAPHHOPPER_URL, params=query_points + list(params.items()))
+        route = offline_router.route(ordered_points)
+    except Exception as e:
+        print(f"Error routing on the offline graph: {e}")
+        route = None
+    return route if route is not None else _straight_line_route(ordered_points)
+
+def get_optimized_route(points: list, orders_data: list = None, rider_capacity: float = 10.0, avoid_points: list = None,
+                        reorder: bool = True, road_costs: bool = False):
+    """
+    points: list of [lat, lng]
+    orders_data: optional list of order dicts with constraints
+    avoid_points: optional list of (lat, lng) points or (lat1, lng1, lat2, lng2) rectangles to avoid
+    reorder: set False when points are already sequenced (e.g. by solve_vrp)
+    road_costs: sequence on cached road distances instead of straight lines
+    Blocking; call from a worker thread. Async handlers use get_optimized_route_async.
+    """
+    from graphhopper_client import client
+
+    # First, reorder points using TSP heuristic with constraints
+    ordered_points = order_route_points(points, orders_data, rider_capacity, reorder, road_costs)
+
+    try:
+        response = client.request_sync("GET", GRAPHHOPPER_URL, params=_route_query(ordered_points, avoid_points))
         if response.status_code == 200:
-            data = response.json()
-            if "paths" in data and len(data["paths"]) > 0:
-                path = data["paths"][0]
-                return {
-                    "distance": path["distance"],
-                    "time": path["time"],
-                    "points": path["points"], # GeoJSON
-                    "ordered_points": ordered_points # Return the order for UI if needed
-                }
+            return _route_result(response.json(), ordered_points)
+        if response.status_code >= 500:
+            # Up but not serving (e.g. mid-import)
+            return _fallback_route(ordered_points)
     except Exception as e:
         print(f"Error connecting to GraphHopper: {e}")
-        # Fallback to straight lines
-        return {
-            "distance": 0,
-            "time": 0,
-            "points": {
-                "type": "LineString",
-                "coordinates": [[p[1], p[0]] for p in ordered_points]
-            },
-            "ordered_points": ordered_points
-        }
+        return _fallback_route(ordered_points)
     return None
 
-def solve_vrp(orders, vehicles):
-    # This would connect to GraphHopper Route Optimization API (if available locally or via cloud)
-    # Since we are using the open source routing engine, we might just do simple TSP for single rider
-    # or use jsprit if integrated.
-    # For this MVP, we will assume a simple TSP for the assigned rider.
-    pass
+async def get_optimized_route_async(points: list, orders_data: list = None, rider_capacity: float = 10.0,
+                                    avoid_points: list = None, reorder: bool = True, road_costs: bool = False):
+    """
+    asyncio-native get_optimized_route: sequencing runs in a worker thread and the
+    GraphHopper call goes through the pooled, rate-limited async client.
+    """
+    import asyncio
+    from graphhopper_client import client
+
+    ordered_points = await asyncio.to_thread(order_route_points, points, orders_data, rider_capacity, reorder, road_costs)
+
+    try:
+        response = await client.request("GET", GRAPHHOPPER_URL, params=_route_query(ordered_points, avoid_points))
+        if response.status_code == 200:
+            return _route_result(response.json(), ordered_points)
+        if response.status_code >= 500:
+            # Up but not serving (e.g. mid-import)
+            return await asyncio.to_thread(_fallback_route, ordered_points)
+    except Exception as e:
+        print(f"Error connecting to GraphHopper: {e}")
+        return await asyncio.to_thread(_fallback_route, ordered_points)
+    return None
+
+def _to_minutes(value, plan_start: datetime):
+    """Convert a datetime (or ISO string) into minutes after plan_start"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return (value - plan_start).total_seconds() / 60.0
+
+class _VRPInstance:
+    """
+    Precomputed, index-based view of a CVRPTW instance.
+    Nodes 0..V-1 are vehicle start positions, nodes V..V+N-1 are orders.
+    """
+    def __init__(self, orders: list, vehicles: list, plan_start: datetime,
+                 speed_kmph: float, service_time_min: float, road_costs: bool = False,
+                 matrices: tuple = None):
+        self.orders = orders
+        self.vehicles = vehicles
+        self.n_vehicles = len(vehicles)
+        self.speed_kmph = speed_kmph
+        self.service_time_min = service_time_min
+
+        coords = [(v['lat'], v['lng']) for v in vehicles] + [(o['lat'], o['lng']) for o in orders]
+        # Plain nested lists: scalar indexing in the search loops is faster than on ndarrays
+        if matrices is not None:
+            # Precomputed (dist_km, time_min or None) over vehicles then orders
+            dist, times = matrices
+            self.dist = np.asarray(dist).tolist()
+            self.times = np.asarray(times).tolist() if times is not None else None
+        elif road_costs:
+            import road_matrix
+            dist, times = road_matrix.get_road_matrix(coords)
+            self.dist = dist.tolist()
+            self.times = times.tolist()
+        else:
+            self.dist = distance_matrix(coords).tolist()
+            self.times = None
+
+        # Room left after what the rider already carries (vehicle 'load')
+        self.capacity = [(v.get('capacity') or 10.0) - (v.get('load') or 0.0) for v in vehicles]
+        self.weight = [o.get('weight') or 1.0 for o in orders]
+        self.priority = [o.get('priority') or 1 for o in orders]
+        self.ready = []
+        self.due = []
+        for o in orders:
+            start = _to_minutes(o.get('delivery_time_start'), plan_start)
+            end = _to_minutes(o.get('delivery_time_end'), plan_start)
+            self.ready.append(max(start, 0.0) if start is not None else 0.0)
+            self.due.append(end if end is not None else float('inf'))
+
+    def node(self, order_idx: int) -> int:
+        return self.n_vehicles + order_idx
+
+    def travel_min(self, a: int, b: int) -> float:
+        if self.times is not None:
+            return self.times[a][b]
+        return self.dist[a][b] / self.speed_kmph * 60.0
+
+    def evaluate(self, vehicle_idx: int, seq: list):
+        """
+        Returns (distance_km, priority_cost) for serving seq with vehicle_idx,
+        or None if the route breaks capacity or a time window.
+        """
+        load = 0.0
+        for i in seq:
+            load += self.weight[i]
+        if load > self.capacity[vehicle_idx]:
+            return None
+
+        distance = 0.0
+        priority_cost = 0.0
+        t = 0.0
+        prev = vehicle_idx
+        for i in seq:
+            node = self.node(i)
+            distance += self.dist[prev][node]
+            t += self.travel_min(prev, node)
+            if t > self.due[i]:
+                return None
+            t = max(t, self.ready[i])
+            # Higher priority orders are cheaper to serve early
+            priority_cost += self.priority[i] * t
+            t += self.service_time_min
+            prev = node
+        return distance, priority_cost
+
+    def route_cost(self, vehicle_idx: int, seq: list) -> float:
+        result = self.evaluate(vehicle_idx, seq)
+        if result is None:
+            return float('inf')
+        distance, priority_cost = result
+        return distance + VRP_PRIORITY_WEIGHT * priority_cost
+
+class RouteSchedule:
+    """
+    Schedule of one route on a _VRPInstance, built once in O(n): arrival and
+    service start per stop, waiting, forward time slack (how much later a stop
+    may be reached without breaking its own or any later time window) and
+    suffix priority sums. Insertion queries against it are O(1).
+    Position 0 is the vehicle start; stop k of seq is position k + 1.
+    """
+    __slots__ = ("inst", "vehicle", "seq", "nodes", "load", "distance", "feasible",
+                 "arrival", "begin", "wait", "slack", "priority_after")
+
+    def __init__(self, inst: _VRPInstance, vehicle_idx: int, seq: list):
+        self.inst = inst
+        self.vehicle = vehicle_idx
+        self.seq = seq
+        n = len(seq)
+        self.nodes = [vehicle_idx] + [inst.node(i) for i in seq]
+        self.load = 0.0
+        for i in seq:
+            self.load += inst.weight[i]
+        self.feasible = self.load <= inst.capacity[vehicle_idx]
+
+        self.arrival = [0.0] * (n + 1)
+        self.begin = [0.0] * (n + 1)
+        self.wait = [0.0] * (n + 2)
+        self.distance = 0.0
+        depart = 0.0
+        for k in range(1, n + 1):
+            i = seq[k - 1]
+            prev, node = self.nodes[k - 1], self.nodes[k]
+            self.distance += inst.dist[prev][node]
+            arrival = depart + inst.travel_min(prev, node)
+            if arrival > inst.due[i]:
+                self.feasible = False
+            begin = max(arrival, inst.ready[i])
+            self.arrival[k] = arrival
+            self.begin[k] = begin
+            self.wait[k] = begin - arrival
+            depart = begin + inst.service_time_min
+
+        inf = float('inf')
+        self.slack = [inf] * (n + 2)
+        self.priority_after = [0.0] * (n + 2)
+        for k in range(n, 0, -1):
+            i = seq[k - 1]
+            self.slack[k] = min(inst.due[i] - self.arrival[k], self.wait[k] + self.slack[k + 1])
+            self.priority_after[k] = self.priority_after[k + 1] + inst.priority[i]
+
+    def departure(self, k: int) -> float:
+        return self.begin[k] + self.inst.service_time_min if k > 0 else 0.0
+
+    def insertion(self, pos: int, order_idx: int):
+        """
+        Inserting order_idx before stop pos (pos == len(seq) appends) in O(1).
+        Returns (cost_delta, km_delta), or None if capacity or a time window breaks.
+        km_delta is exact. The priority part of cost_delta assumes the delay
+        propagates to every later stop, so it is exact unless a later stop
+        waits and an upper bound otherwise.
+        """
+        inst = self.inst
+        if self.load + inst.weight[order_idx] > inst.capacity[self.vehicle]:
+            return None
+        prev = self.nodes[pos]
+        node = inst.node(order_idx)
+        arrival = self.departure(pos) + inst.travel_min(prev, node)
+        if arrival > inst.due[order_idx]:
+            return None
+        begin = max(arrival, inst.ready[order_idx])
+
+        km = inst.dist[prev][node]
+        push_cost = 0.0
+        if pos < len(self.seq):
+            nxt = self.nodes[pos + 1]
+            push = begin + inst.service_time_min + inst.travel_min(node, nxt) - self.arrival[pos + 1]
+            if push > self.slack[pos + 1]:
+                return None
+            km += inst.dist[node][nxt] - inst.dist[prev][nxt]
+            push_cost = self.priority_after[pos + 1] * max(push - self.wait[pos + 1], 0.0)
+        return km + VRP_PRIORITY_WEIGHT * (inst.priority[order_idx] * begin + push_cost), km
+
+def _best_insertion(inst: _VRPInstance, routes: list, costs: list, order_idx: int, vehicle_indices=None):
+    """Cheapest feasible (delta, vehicle_idx, position) for inserting order_idx, or None"""
+    best = None
+    for v in (vehicle_indices if vehicle_indices is not None else range(len(routes))):
+        if costs[v] == float('inf'):
+            continue
+        schedule = RouteSchedule(inst, v, routes[v])
+        for pos in range(len(routes[v]) + 1):
+            move = schedule.insertion(pos, order_idx)
+            if move is None:
+                continue
+            if best is None or move[0] < best[0]:
+                best = (move[0], v, pos)
+    return best
+
+def _construct(inst: _VRPInstance, seed: int = None):
+    """
+    Priority-first cheapest insertion over all vehicles.
+    With a seed, orders of equal priority are inserted in a randomised
+    (deadline-biased) order, so different seeds give different starts.
+    """
+    routes = [[] for _ in range(inst.n_vehicles)]
+    costs = [0.0] * inst.n_vehicles
+    unassigned = []
+    if seed is None:
+        order_indices = sorted(
+            range(len(inst.orders)),
+            key=lambda i: (-inst.priority[i], inst.due[i], inst.ready[i])
+        )
+    else:
+        import random
+        rng = random.Random(seed)
+        order_indices = list(range(len(inst.orders)))
+        rng.shuffle(order_indices)
+        noise = {i: rng.uniform(0.0, 30.0) for i in order_indices}
+        order_indices.sort(key=lambda i: (-inst.priority[i], inst.due[i] + noise[i]))
+    for i in order_indices:
+        best = _best_insertion(inst, routes, costs, i)
+        if best is None:
+            unassigned.append(i)
+            continue
+        _, v, pos = best
+        routes[v].insert(pos, i)
+        costs[v] = inst.route_cost(v, routes[v])
+    return routes, costs, unassigned
+
+def _two_opt(inst: _VRPInstance, routes: list, costs: list, deadline: float) -> bool:
+    """Intra-route 2-opt: reverse segments while it lowers the route cost"""
+    improved = False
+    for v, seq in enumerate(routes):
+        if len(seq) < 3:
+            continue
+        i = 0
+        while i < len(seq) - 1:
+            if time.monotonic() > deadline:
+                return improved
+            for j in range(i + 1, len(seq)):
+                candidate = seq[:i] + seq[i:j + 1][::-1] + seq[j + 1:]
+                cost = inst.route_cost(v, candidate)
+                if cost < costs[v] - VRP_EPSILON:
+                    seq[:] = candidate
+                    costs[v] = cost
+                    improved = True
+            i += 1
+    return improved
+
+def _relocate(inst: _VRPInstance, routes: list, costs: list, deadline: float) -> bool:
+    """Move single orders to their cheapest feasible position in any route"""
+    improved = False
+    for v in range(len(routes)):
+        pos = 0
+        while pos < len(routes[v]):
+            if time.monotonic() > deadline:
+                return improved
+            order_idx = routes[v][pos]
+            reduced = routes[v][:pos] + routes[v][pos + 1:]
+            removal_gain = costs[v] - inst.route_cost(v, reduced)
+
+            original_route, original_cost = routes[v], costs[v]
+            routes[v], costs[v] = reduced, costs[v] - removal_gain
+            best = _best_insertion(inst, routes, costs, order_idx)
+
+            if best is not None and best[0] < removal_gain - VRP_EPSILON:
+                _, target, target_pos = best
+                routes[target].insert(target_pos, order_idx)
+                costs[target] = inst.route_cost(target, routes[target])
+                improved = True
+                if target == v:
+                    pos += 1
+            else:
+                routes[v], costs[v] = original_route, original_cost
+                pos += 1
+    return improved
+
+def _swap(inst: _VRPInstance, routes: list, costs: list, deadline: float) -> bool:
+    """Exchange one order between two different routes"""
+    improved = False
+    for a in range(len(routes)):
+        for b in range(a + 1, len(routes)):
+            for i in range(len(routes[a])):
+                for j in range(len(routes[b])):
+                    if time.monotonic() > deadline:
+                        return improved
+                    seq_a = routes[a][:]
+                    seq_b = routes[b][:]
+                    seq_a[i], seq_b[j] = seq_b[j], seq_a[i]
+                    cost_a = inst.route_cost(a, seq_a)
+                    if cost_a == float('inf'):
+                        continue
+                    cost_b = inst.route_cost(b, seq_b)
+                    if cost_a + cost_b < costs[a] + costs[b] - VRP_EPSILON:
+                        routes[a], routes[b] = seq_a, seq_b
+                        costs[a], costs[b] = cost_a, cost_b
+                        improved = True
+    return improved
+
+def _insert_unassigned(inst: _VRPInstance, routes: list, costs: list, unassigned: list) -> bool:
+    """Retry orders that did not fit, now that local search has freed up room"""
+    improved = False
+    for order_idx in list(unassigned):
+        best = _best_insertion(inst, routes, costs, order_idx)
+        if best is not None:
+            _, v, pos = best
+            routes[v].insert(pos, order_idx)
+            costs[v] = inst.route_cost(v, routes[v])
+            unassigned.remove(order_idx)
+            improved = True
+    return improved
+
+def solve_vrp(orders: list, vehicles: list, time_limit: float = 2.0, plan_start: Optional[datetime] = None,
+              speed_kmph: float = AVERAGE_SPEED_KMPH, service_time_min: float = SERVICE_TIME_MIN,
+              road_costs: bool = False, seed: int = None, matrices: tuple = None):
+    """
+    Capacitated VRP with time windows for the whole fleet.
+    orders: list of order dicts (lat, lng, weight, priority, delivery_time_start/end)
+    vehicles: list of rider dicts (id, lat, lng, capacity, optional load already on board)
+    time_limit: seconds allowed for local search after the initial solution
+    road_costs: plan on cached GraphHopper road distances/times instead of haversine
+    seed: randomise the construction (see _construct); None is deterministic
+    matrices: precomputed (dist_km, time_min or None) over vehicles then orders
+    Returns: {"routes": [...], "unassigned": [...], "cost", "solve_time"} where every
+    route carries the rider id, its orders in visiting order, the points (rider first) and totals.
+    """
+    if not vehicles:
+        return {"routes": [], "unassigned": list(orders or []), "cost": 0.0, "solve_time": 0.0}
+    if not orders:
+        return {"routes": [], "unassigned": [], "cost": 0.0, "solve_time": 0.0}
+
+    started = time.monotonic()
+    deadline = started + max(time_limit, 0.0)
+    plan_start = plan_start or datetime.utcnow()
+
+    inst = _VRPInstance(orders, vehicles, plan_start, speed_kmph, service_time_min, road_costs, matrices)
+    routes, costs, unassigned = _construct(inst, seed)
+
+    # Local search until no operator improves or the time budget runs out
+    while time.monotonic() < deadline:
+        improved = _relocate(inst, routes, costs, deadline)
+        improved = _swap(inst, routes, costs, deadline) or improved
+        improved = _two_opt(inst, routes, costs, deadline) or improved
+        if unassigned:
+            improved = _insert_unassigned(inst, routes, costs, unassigned) or improved
+        if not improved:
+            break
+
+    result_routes = []
+    for v, seq in enumerate(routes):
+        if not seq:
+            continue
+        vehicle = vehicles[v]
+        distance, _ = inst.evaluate(v, seq)
+        result_routes.append({
+            "vehicle_id": vehicle.get('id', v),
+            "orders": [orders[i] for i in seq],
+            "points": [(vehicle['lat'], vehicle['lng'])] + [(orders[i]['lat'], orders[i]['lng']) for i in seq],
+            "distance": distance,
+            "load": sum(inst.weight[i] for i in seq),
+        })
+
+    return {
+        "routes": result_routes,
+        "unassigned": [orders[i] for i in unassigned],
+        "cost": sum(costs),
+        "solve_time": time.monotonic() - started,
+    }
+
+def insert_into_route(start: tuple, route_orders: list, new_order: dict, rider_capacity: float = 10.0,
+                      plan_start: Optional[datetime] = None):
+    """
+    Cheapest insertion of new_order into an existing single-rider sequence.
+    start: rider (lat, lng); route_orders: order dicts in visiting order.
+    Returns (position, feasible). When no position respects capacity and time
+    windows, the position that adds the least distance is returned with feasible=False.
+    """
+    vehicle = {'lat': start[0], 'lng': start[1], 'capacity': rider_capacity}
+    inst = _VRPInstance(route_orders + [new_order], [vehicle], plan_start or datetime.utcnow(),
+                        AVERAGE_SPEED_KMPH, SERVICE_TIME_MIN)
+    seq = list(range(len(route_orders)))
+    new_idx = len(route_orders)
+
+    best = _best_insertion(inst, [seq], [inst.route_cost(0, seq)], new_idx)
+    if best is not None:
+        return best[2], True
+
+    # Infeasible either way: minimise added kilometres
+    nodes = [0] + [inst.node(i) for i in seq]
+    new_node = inst.node(new_idx)
+    best_pos, best_delta = len(seq), float('inf')
+    for pos in range(len(seq) + 1):
+        prev = nodes[pos]
+        delta = inst.dist[prev][new_node]
+        if pos < len(seq):
+            nxt = nodes[pos + 1]
+            delta += inst.dist[new_node][nxt] - inst.dist[prev][nxt]
+        if delta < best_delta:
+            best_pos, best_delta = pos, delta
+    return best_pos, False
+
+def repair_route(start: tuple, route_orders: list, rider_capacity: float = 10.0, time_limit: float = 0.05,
+                 plan_start: Optional[datetime] = None) -> list:
+    """
+    Local repair of a single-rider sequence (e.g. after a removal): relocate and
+    2-opt moves, accepted only if the route stays feasible and gets cheaper.
+    Returns the order dicts in their new visiting order.
+    """
+    if len(route_orders) < 3:
+        return list(route_orders)
+    vehicle = {'lat': start[0], 'lng': start[1], 'capacity': rider_capacity}
+    inst = _VRPInstance(route_orders, [vehicle], plan_start or datetime.utcnow(),
+                        AVERAGE_SPEED_KMPH, SERVICE_TIME_MIN)
+    routes = [list(range(len(route_orders)))]
+    costs = [inst.route_cost(0, routes[0])]
+    if costs[0] == float('inf'):
+        # Already infeasible: leave the sequence as the rider knows it
+        return list(route_orders)
+
+    deadline = time.monotonic() + time_limit
+    while time.monotonic() < deadline:
+        improved = _relocate(inst, routes, costs, deadline)
+        improved = _two_opt(inst, routes, costs, deadline) or improved
+        if not improved:
+            break
+    return [route_orders[i] for i in routes[0]]
+
+def improve_route_anytime(start: tuple, route_orders: list, rider_capacity: float = 10.0, time_limit: float = 2.0,
+                          plan_start: Optional[datetime] = None, road_costs: bool = False, seed: int = None,
+                          stop=None):
+    """
+    Anytime improvement of a single-rider sequence by iterated local search:
+    relocate/2-opt to a local optimum, then a random double-bridge kick from
+    the best route so far, until time_limit seconds pass.
+    route_orders: order dicts in their current visiting order (the starting point).
+    Yields (order dicts in visiting order, cost) each time a cheaper feasible route is found.
+    Returns early when no kick can change the route any more, or once stop (a threading.Event) is set.
+    """
+    import random
+    if not route_orders:
+        return
+    deadline = time.monotonic() + max(time_limit, 0.0)
+    vehicle = {'lat': start[0], 'lng': start[1], 'capacity': rider_capacity}
+    inst = _VRPInstance(route_orders, [vehicle], plan_start or datetime.utcnow(),
+                        AVERAGE_SPEED_KMPH, SERVICE_TIME_MIN, road_costs)
+    rng = random.Random(seed)
+    n = len(route_orders)
+
+    best_seq = list(range(n))
+    best_cost = inst.route_cost(0, best_seq)
+    if best_cost == float('inf'):
+        # Start from the feasible construction instead of the given order
+        routes, costs, unassigned = _construct(inst)
+        if unassigned:
+            return
+        best_seq, best_cost = routes[0], costs[0]
+        yield [route_orders[i] for i in best_seq], best_cost
+    if n <= 3:
+        # A double bridge needs four stops; relocate/2-opt already reach every order of three
+        return
+
+    routes, costs = [best_seq[:]], [best_cost]
+    while time.monotonic() < deadline and not (stop is not None and stop.is_set()):
+        while time.monotonic() < deadline:
+            improved = _relocate(inst, routes, costs, deadline)
+            improved = _two_opt(inst, routes, costs, deadline) or improved
+            if not improved:
+                break
+        if costs[0] < best_cost - VRP_EPSILON:
+            best_seq, best_cost = routes[0][:], costs[0]
+            yield [route_orders[i] for i in best_seq], best_cost
+
+        # Kick: reconnect three random segments of the best route (double bridge)
+        for _ in range(20):
+            a, b, c = sorted(rng.sample(range(1, n), 3))
+            candidate = best_seq[:a] + best_seq[b:c] + best_seq[a:b] + best_seq[c:]
+            cost = inst.route_cost(0, candidate)
+            if cost != float('inf'):
+                routes[0], costs[0] = candidate, cost
+                break
+        else:
+            # Tight windows leave no feasible kick: the search cannot move
+            return
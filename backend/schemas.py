@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
 from models import OrderStatus, RiderStatus
 
 class Token(BaseModel):
@@ -19,12 +19,21 @@ class OrderBase(BaseModel):
     lat: float
     lng: float
 
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored as naive UTC (TIMESTAMP WITHOUT TIME ZONE); asyncpg rejects aware ones"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
 class OrderCreate(OrderBase):
     priority: Optional[int] = 1
     weight: Optional[float] = 1.0
     delivery_time_start: Optional[datetime] = None
     delivery_time_end: Optional[datetime] = None
 
+    # The dashboard sends toISOString() values ("...Z")
+    _naive_windows = field_validator("delivery_time_start", "delivery_time_end")(naive_utc)
+
 class Order(OrderBase):
     id: int
     status: OrderStatus
@@ -67,6 +76,12 @@ class LocationUpdate(BaseModel):
     class Config:
         from_attributes = True
 
+class RiderLocation(BaseModel):
+    rider_id: int
+    lat: float
+    lng: float
+    recorded_at: Optional[datetime] = None
+
 class RouteRequest(BaseModel):
     rider_id: int
     order_ids: List[int]
@@ -77,3 +92,14 @@ class OptimizationResult(BaseModel):
     distance: float
     time: float
     waypoints: List[dict]
+
+class StoredRoute(BaseModel):
+    rider_id: int
+    distance: Optional[float] = None
+    time: Optional[float] = None
+    encoded_polyline: Optional[str] = None
+    points: dict
+    ordered_points: List[List[float]]
+    order_ids: List[int]
+    fingerprint: Optional[str] = None
+    updated_at: Optional[datetime] = None
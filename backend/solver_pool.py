@@ -0,0 +1,270 @@
+"""
+CVRPTW solving across processes.
+
+Multi-start: the parent builds the distance (and road time) matrices once
+and places them in shared memory; every worker process attaches to them by
+name, runs solve_vrp with its own seed and sends back only the plan. The
+cheapest plan that leaves the fewest orders unassigned wins.
+
+Zoned: orders and riders are split into fixed grid zones that are solved
+independently, each always on the same worker process. With road costs the
+parent builds every zone's matrices from its own road matrix cache, so the
+cache (and its file) has a single owner. Orders a zone could not place are
+then offered to riders of the neighbouring zones.
+"""
+import math
+import multiprocessing
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+import routing
+from spatial import KM_PER_DEG_LAT
+
+SOLVER_PROCESSES = int(os.getenv("SOLVER_PROCESSES", str(os.cpu_count() or 1)))
+# Below this many orders a single in-process solve beats the process round trip
+PARALLEL_MIN_ORDERS = 40
+# Edge of a planning zone and the order count above which plan-fleet goes zoned
+ZONE_KM = 5.0
+ZONED_MIN_ORDERS = 500
+# Latitude whose longitude scale sizes every zone column (set it to the service area's for square zones)
+ZONE_REF_LAT = float(os.getenv("ZONE_REF_LAT", "0"))
+# How many rings of neighbouring zones an unplaced order may move out to
+REBALANCE_RINGS = 2
+
+# One single-process executor per worker, so work can be pinned to a worker
+_workers: list = []
+
+def _get_workers() -> list:
+    if not _workers:
+        # spawn: forking a process that runs an event loop and thread pools is unsafe
+        context = multiprocessing.get_context("spawn")
+        for _ in range(max(SOLVER_PROCESSES, 1)):
+            _workers.append(ProcessPoolExecutor(max_workers=1, mp_context=context))
+    return _workers
+
+def shutdown():
+    for worker in _workers:
+        worker.shutdown(wait=False, cancel_futures=True)
+    _workers.clear()
+
+class SharedMatrix:
+    """A float64 matrix copied once into a named shared memory block"""
+    def __init__(self, array: np.ndarray):
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        self.shape = array.shape
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(self.shape, dtype=np.float64, buffer=self.shm.buf)[:] = array
+
+    @property
+    def handle(self) -> tuple:
+        return self.shm.name, self.shape
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+def _attach(handle):
+    """(shm, array view) for a SharedMatrix handle, or (None, None)"""
+    if handle is None:
+        return None, None
+    name, shape = handle
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+def _solve_start(orders, vehicles, time_limit, plan_start, speed_kmph, service_time_min, seed, dist_handle, time_handle):
+    """Worker side: one seeded solve_vrp on the shared matrices"""
+    dist_shm, dist = _attach(dist_handle)
+    time_shm, times = _attach(time_handle)
+    try:
+        return routing.solve_vrp(orders, vehicles, time_limit, plan_start, speed_kmph, service_time_min,
+                                 seed=seed, matrices=(dist, times))
+    finally:
+        # Views must go before the blocks can be closed
+        del dist, times
+        for shm in (dist_shm, time_shm):
+            if shm is not None:
+                shm.close()
+
+def solve_vrp_parallel(orders: list, vehicles: list, time_limit: float = 2.0, starts: int = None,
+                       plan_start: Optional[datetime] = None,
+                       speed_kmph: float = routing.AVERAGE_SPEED_KMPH,
+                       service_time_min: float = routing.SERVICE_TIME_MIN,
+                       road_costs: bool = False) -> dict:
+    """
+    solve_vrp from `starts` randomised starts (default: one per process) in
+    parallel, each with time_limit seconds of local search. Returns the best
+    plan, in solve_vrp's format plus "starts". Small instances are solved
+    in-process.
+    """
+    starts = starts or SOLVER_PROCESSES
+    plan_start = plan_start or datetime.utcnow()
+    if starts <= 1 or len(orders) < PARALLEL_MIN_ORDERS or not vehicles:
+        plan = routing.solve_vrp(orders, vehicles, time_limit, plan_start, speed_kmph, service_time_min, road_costs)
+        plan["starts"] = 1
+        return plan
+
+    coords = [(v['lat'], v['lng']) for v in vehicles] + [(o['lat'], o['lng']) for o in orders]
+    if road_costs:
+        import road_matrix
+        dist, times = road_matrix.get_road_matrix(coords)
+    else:
+        dist, times = routing.distance_matrix(coords), None
+
+    shared = [SharedMatrix(dist)] + ([SharedMatrix(times)] if times is not None else [])
+    try:
+        dist_handle = shared[0].handle
+        time_handle = shared[1].handle if times is not None else None
+        workers = _get_workers()
+        futures = [
+            # Seed 0 is the deterministic construction solve_vrp uses by default
+            workers[seed % len(workers)].submit(_solve_start, orders, vehicles, time_limit, plan_start, speed_kmph, service_time_min,
+                            None if seed == 0 else seed, dist_handle, time_handle)
+            for seed in range(starts)
+        ]
+        plans = [f.result() for f in futures]
+    finally:
+        for block in shared:
+            block.release()
+
+    best = min(plans, key=lambda p: (len(p["unassigned"]), p["cost"]))
+    best["starts"] = len(plans)
+    return best
+
+def zone_of(lat: float, lng: float, zone_km: float = ZONE_KM) -> tuple:
+    """(row, col) of the zone_km grid cell containing (lat, lng)"""
+    # One longitude scale for the whole grid: scaling by each point's own
+    # latitude would shear columns into parallelograms
+    km_per_deg_lng = KM_PER_DEG_LAT * max(math.cos(math.radians(ZONE_REF_LAT)), 1e-6)
+    return math.floor(lat * KM_PER_DEG_LAT / zone_km), math.floor(lng * km_per_deg_lng / zone_km)
+
+def zone_worker(zone: tuple, n_workers: int) -> int:
+    """Stable zone -> worker mapping (Python's hash() is salted per process)"""
+    return zlib.crc32(f"{zone[0]}:{zone[1]}".encode()) % n_workers
+
+def _solve_zone(orders, vehicles, time_limit, plan_start, speed_kmph, service_time_min, matrices):
+    """Worker side: one zone, on the road matrices the parent built (None: haversine)"""
+    return routing.solve_vrp(orders, vehicles, time_limit, plan_start, speed_kmph, service_time_min,
+                             matrices=matrices)
+
+def _route_km(start: tuple, route_orders: list) -> float:
+    points = [start] + [(o['lat'], o['lng']) for o in route_orders]
+    return sum(routing.calculate_distance(points[i], points[i + 1]) for i in range(len(points) - 1))
+
+def _rebalance(unassigned: list, routes: dict, vehicles: dict, vehicle_zone: dict,
+               plan_start: datetime, zone_km: float) -> list:
+    """
+    Offer orders a zone could not place to riders of the neighbouring zones,
+    one ring further out at a time up to REBALANCE_RINGS: cheapest feasible
+    insertion wins. Returns the orders that still fit nowhere.
+    """
+    by_zone = {}
+    for vid, zone in vehicle_zone.items():
+        by_zone.setdefault(zone, []).append(vid)
+    left = []
+    for order in unassigned:
+        row, col = zone_of(order['lat'], order['lng'], zone_km)
+        best = None
+        for ring in range(1, REBALANCE_RINGS + 1):
+            if best is not None:
+                break
+            for dr, dc in ((dr, dc) for dr in range(-ring, ring + 1) for dc in range(-ring, ring + 1)
+                           if max(abs(dr), abs(dc)) == ring or ring == 1):
+                for vid in by_zone.get((row + dr, col + dc), ()):
+                    vehicle = vehicles[vid]
+                    start = (vehicle['lat'], vehicle['lng'])
+                    seq = routes.get(vid, [])
+                    room = (vehicle.get('capacity') or 10.0) - (vehicle.get('load') or 0.0)
+                    pos, feasible = routing.insert_into_route(start, seq, order, room, plan_start)
+                    if not feasible:
+                        continue
+                    added = _route_km(start, seq[:pos] + [order] + seq[pos:]) - _route_km(start, seq)
+                    if best is None or added < best[0]:
+                        best = (added, vid, pos)
+        if best is None:
+            left.append(order)
+            continue
+        _, vid, pos = best
+        routes.setdefault(vid, []).insert(pos, order)
+    return left
+
+def solve_vrp_zoned(orders: list, vehicles: list, time_limit: float = 2.0, zone_km: float = ZONE_KM,
+                    plan_start: Optional[datetime] = None,
+                    speed_kmph: float = routing.AVERAGE_SPEED_KMPH,
+                    service_time_min: float = routing.SERVICE_TIME_MIN,
+                    road_costs: bool = False) -> dict:
+    """
+    City-scale planning: one solve_vrp per zone_km grid zone, zones in parallel
+    on their pinned workers, then boundary rebalancing of unplaced orders.
+    Returns solve_vrp's format plus "zones".
+    """
+    started = time.monotonic()
+    plan_start = plan_start or datetime.utcnow()
+    if not orders or not vehicles:
+        plan = routing.solve_vrp(orders, vehicles, time_limit, plan_start, speed_kmph, service_time_min, road_costs)
+        plan["zones"] = 0
+        return plan
+
+    zone_orders, zone_vehicles, vehicle_zone = {}, {}, {}
+    for o in orders:
+        zone_orders.setdefault(zone_of(o['lat'], o['lng'], zone_km), []).append(o)
+    for v in vehicles:
+        zone = zone_of(v['lat'], v['lng'], zone_km)
+        zone_vehicles.setdefault(zone, []).append(v)
+        vehicle_zone[v['id']] = zone
+
+    workers = _get_workers()
+    futures = {}
+    unassigned = []
+    for zone, members in zone_orders.items():
+        if zone not in zone_vehicles:
+            # Nobody starts here: left for the neighbours
+            unassigned.extend(members)
+            continue
+        matrices = None
+        if road_costs:
+            # Built here rather than in the worker: workers never touch the cache,
+            # and zones submitted so far solve while the next matrix is fetched
+            import road_matrix
+            coords = [(v['lat'], v['lng']) for v in zone_vehicles[zone]] + [(o['lat'], o['lng']) for o in members]
+            matrices = road_matrix.get_road_matrix(coords)
+        worker = workers[zone_worker(zone, len(workers))]
+        futures[zone] = worker.submit(_solve_zone, members, zone_vehicles[zone], time_limit, plan_start,
+                                      speed_kmph, service_time_min, matrices)
+
+    routes = {}
+    for zone, future in futures.items():
+        plan = future.result()
+        for route in plan["routes"]:
+            routes[route["vehicle_id"]] = route["orders"]
+        unassigned.extend(plan["unassigned"])
+
+    vehicles_by_id = {v['id']: v for v in vehicles}
+    unassigned = _rebalance(unassigned, routes, vehicles_by_id, vehicle_zone, plan_start, zone_km)
+
+    result_routes = []
+    for vid, seq in routes.items():
+        if not seq:
+            continue
+        vehicle = vehicles_by_id[vid]
+        start = (vehicle['lat'], vehicle['lng'])
+        result_routes.append({
+            "vehicle_id": vid,
+            "orders": seq,
+            "points": [start] + [(o['lat'], o['lng']) for o in seq],
+            "distance": _route_km(start, seq),
+            "load": sum(o.get('weight') or 1.0 for o in seq),
+        })
+    return {
+        "routes": result_routes,
+        "unassigned": unassigned,
+        "cost": sum(r["distance"] for r in result_routes),
+        "solve_time": time.monotonic() - started,
+        "zones": len(zone_orders),
+    }
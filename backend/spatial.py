@@ -0,0 +1,153 @@
+import math
+import numpy as np
+from typing import List, Optional
+
+KM_PER_DEG_LAT = 111.32
+
+class GridIndex:
+    """
+    Uniform lat/lng grid over a fixed set of points for radius and nearest queries.
+    points: sequence or (N, 2) array of (lat, lng). Query results are indices into points.
+    cell_km: grid cell edge; queries are cheapest when it is close to the usual radius.
+    """
+    def __init__(self, points, cell_km: float = 1.0):
+        coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.lats = coords[:, 0]
+        self.lngs = coords[:, 1]
+        self.cell_km = cell_km
+
+        ref_lat = float(np.max(np.abs(self.lats))) if len(coords) else 0.0
+        self.cell_lat = cell_km / KM_PER_DEG_LAT
+        # Size longitude cells for the highest latitude so a cell never spans less than cell_km
+        self.cell_lng = cell_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(ref_lat)), 1e-6))
+
+        rows = np.floor(self.lats / self.cell_lat).astype(np.int64)
+        cols = np.floor(self.lngs / self.cell_lng).astype(np.int64)
+        self.cells = {}
+        if len(coords):
+            order = np.lexsort((cols, rows))
+            keys = np.stack((rows[order], cols[order]), axis=1)
+            starts = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+            for group in np.split(order, starts):
+                self.cells[(int(rows[group[0]]), int(cols[group[0]]))] = group
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _candidates(self, lat: float, lng: float, radius_km: float) -> np.ndarray:
+        """Indices in every cell the query circle can touch"""
+        row = math.floor(lat / self.cell_lat)
+        col = math.floor(lng / self.cell_lng)
+        span_rows = math.ceil(radius_km / self.cell_km)
+        # Widest longitude span of the circle is at its pole-most latitude
+        edge_lat = min(abs(lat) + radius_km / KM_PER_DEG_LAT, 90.0)
+        lng_deg = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(edge_lat)), 1e-6))
+        span_cols = math.ceil(lng_deg / self.cell_lng)
+
+        found = []
+        if (2 * span_rows + 1) * (2 * span_cols + 1) > len(self.cells):
+            # Query window covers more cells than are occupied: walk the occupied ones
+            for (r, c), bucket in self.cells.items():
+                if abs(r - row) <= span_rows and abs(c - col) <= span_cols:
+                    found.append(bucket)
+        else:
+            for r in range(row - span_rows, row + span_rows + 1):
+                for c in range(col - span_cols, col + span_cols + 1):
+                    bucket = self.cells.get((r, c))
+                    if bucket is not None:
+                        found.append(bucket)
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(found)
+
+    def _distances(self, lat: float, lng: float, idx: np.ndarray) -> np.ndarray:
+        """Haversine km from (lat, lng) to the indexed points"""
+        from routing import distance_matrix
+        return distance_matrix([(lat, lng)], np.stack((self.lats[idx], self.lngs[idx]), axis=1))[0]
+
+    def query_radius(self, lat: float, lng: float, radius_km: float) -> np.ndarray:
+        """Indices of all points within radius_km of (lat, lng)"""
+        idx = self._candidates(lat, lng, radius_km)
+        if not len(idx):
+            return idx
+        return idx[self._distances(lat, lng, idx) <= radius_km]
+
+    def nearest(self, lat: float, lng: float, k: int = 1, max_radius_km: Optional[float] = None) -> List[tuple]:
+        """
+        Up to k (index, distance_km) pairs closest to (lat, lng), nearest first.
+        Searches outward ring by ring; max_radius_km caps the search.
+        """
+        if not len(self) or k <= 0:
+            return []
+        radius = self.cell_km
+        while True:
+            idx = self._candidates(lat, lng, radius)
+            if len(idx):
+                dist = self._distances(lat, lng, idx)
+                inside = dist <= radius
+                # Anything within radius is final: no unseen point can be closer
+                if np.count_nonzero(inside) >= k or len(idx) == len(self) or \
+                        (max_radius_km is not None and radius >= max_radius_km):
+                    if max_radius_km is not None:
+                        keep = dist <= max_radius_km
+                        idx, dist = idx[keep], dist[keep]
+                    best = np.argsort(dist, kind='stable')[:k]
+                    return [(int(idx[i]), float(dist[i])) for i in best]
+            elif max_radius_km is not None and radius >= max_radius_km:
+                return []
+            radius *= 2
+
+    def nearest_many(self, points, k: int = 1, max_radius_km: float = None):
+        """
+        Batched nearest(): for every query point, up to k indexed points within
+        max_radius_km (unbounded if None), nearest first. Returns (idx, dist)
+        arrays of shape (len(points), k), padded with -1 / inf.
+        Queries are grouped by grid cell so each cell costs one distance block.
+        """
+        from routing import distance_matrix
+        coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        n = len(coords)
+        out_idx = np.full((n, k), -1, dtype=np.int64)
+        out_dist = np.full((n, k), np.inf)
+        if not n or not len(self) or k <= 0:
+            return out_idx, out_dist
+
+        all_idx = np.arange(len(self))
+        if max_radius_km is None:
+            # Every indexed point is a candidate: plain row chunks bound the block size
+            groups = np.array_split(np.arange(n), -(-n // 1024))
+        else:
+            rows = np.floor(coords[:, 0] / self.cell_lat).astype(np.int64)
+            cols = np.floor(coords[:, 1] / self.cell_lng).astype(np.int64)
+            order = np.lexsort((cols, rows))
+            keys = np.stack((rows[order], cols[order]), axis=1)
+            starts = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+            groups = np.split(order, starts)
+
+        for group in groups:
+            block = coords[group]
+            if max_radius_km is None:
+                cand = all_idx
+            else:
+                # One candidate set per cell: the radius plus the farthest query from the cell's centre
+                centre = block.mean(axis=0)
+                spread = float(distance_matrix([centre], block)[0].max())
+                cand = self._candidates(centre[0], centre[1], max_radius_km + spread)
+                if not len(cand):
+                    continue
+            dist = distance_matrix(block, np.stack((self.lats[cand], self.lngs[cand]), axis=1))
+            if max_radius_km is not None:
+                dist[dist > max_radius_km] = np.inf
+            kk = min(k, len(cand))
+            if len(cand) > kk:
+                part = np.argpartition(dist, kk - 1, axis=1)[:, :kk]
+            else:
+                part = np.broadcast_to(np.arange(kk), (len(group), kk))
+            part_dist = np.take_along_axis(dist, part, axis=1)
+            ranked = np.argsort(part_dist, axis=1, kind='stable')
+            best_dist = np.take_along_axis(part_dist, ranked, axis=1)
+            best_idx = cand[np.take_along_axis(part, ranked, axis=1)]
+            best_idx[np.isinf(best_dist)] = -1
+            out_idx[group, :kk] = best_idx
+            out_dist[group, :kk] = best_dist
+        return out_idx, out_dist
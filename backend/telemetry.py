@@ -0,0 +1,122 @@
+"""
+Rider telemetry ingestion. GPS fixes land in an in-memory latest-position
+store; a background loop writes dirty positions to users.current_lat/lng in
+one bulk UPDATE, and another publishes at most one rider_update per rider
+per broadcast interval.
+"""
+import asyncio
+import threading
+import time
+from typing import Optional
+
+import models
+from database import SessionLocal
+
+FLUSH_INTERVAL_SECONDS = 5.0
+BROADCAST_INTERVAL_SECONDS = 1.0
+
+class PositionStore:
+    """Latest known position per rider plus the sets still to be flushed / broadcast"""
+    def __init__(self):
+        self._positions = {}  # rider_id -> (lat, lng, recorded_at, name)
+        self._dirty = set()
+        self._unbroadcast = set()
+        self._lock = threading.Lock()
+
+    def record(self, rider_id: int, lat: float, lng: float, recorded_at: Optional[float] = None, name: str = None):
+        """Keep a fix if it is newer than what we have. Returns True if it was kept."""
+        recorded_at = recorded_at or time.time()
+        with self._lock:
+            current = self._positions.get(rider_id)
+            if current is not None and current[2] > recorded_at:
+                return False
+            if name is None and current is not None:
+                name = current[3]
+            self._positions[rider_id] = (lat, lng, recorded_at, name)
+            self._dirty.add(rider_id)
+            self._unbroadcast.add(rider_id)
+            return True
+
+    def position(self, rider_id: int):
+        """(lat, lng) of the latest fix, or None"""
+        entry = self._positions.get(rider_id)
+        return (entry[0], entry[1]) if entry else None
+
+    def take_dirty(self) -> list:
+        with self._lock:
+            rows = [{"id": rid, "current_lat": self._positions[rid][0], "current_lng": self._positions[rid][1]}
+                    for rid in self._dirty]
+            self._dirty.clear()
+        return rows
+
+    def restore_dirty(self, rider_ids):
+        """Put back riders whose flush failed so the next round retries them"""
+        with self._lock:
+            self._dirty.update(rider_ids)
+
+    def take_unbroadcast(self) -> list:
+        with self._lock:
+            rows = [(rid,) + self._positions[rid] for rid in self._unbroadcast]
+            self._unbroadcast.clear()
+        return rows
+
+store = PositionStore()
+
+def flush_positions() -> int:
+    """Write all dirty positions in one bulk UPDATE. Returns the number of riders written."""
+    rows = store.take_dirty()
+    if not rows:
+        return 0
+    db = SessionLocal()
+    try:
+        db.bulk_update_mappings(models.User, rows)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        store.restore_dirty(row["id"] for row in rows)
+        print(f"Error flushing rider positions: {e}")
+        return 0
+    finally:
+        db.close()
+    return len(rows)
+
+async def broadcast_positions(manager) -> int:
+    """Publish the latest position of every rider that moved since the last round"""
+    rows = store.take_unbroadcast()
+    for rider_id, lat, lng, _, name in rows:
+        await manager.publish_rider(rider_id, {
+            "type": "rider_update",
+            "data": {
+                "rider_id": rider_id,
+                "lat": lat,
+                "lng": lng,
+                "name": name
+            }
+        }, lat=lat, lng=lng)
+    return len(rows)
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+        await asyncio.to_thread(flush_positions)
+
+async def _broadcast_loop(manager):
+    while True:
+        await asyncio.sleep(BROADCAST_INTERVAL_SECONDS)
+        try:
+            await broadcast_positions(manager)
+        except Exception as e:
+            print(f"Error broadcasting rider positions: {e}")
+
+_tasks = []
+
+def start(manager):
+    _tasks.append(asyncio.create_task(_flush_loop()))
+    _tasks.append(asyncio.create_task(_broadcast_loop(manager)))
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
+    # Do not lose the last few seconds of fixes on shutdown
+    await asyncio.to_thread(flush_positions)
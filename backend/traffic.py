@@ -0,0 +1,98 @@
+"""
+Traffic incidents reported by riders. Reports expire after a TTL, and a
+report close to a live incident is merged into it by growing the incident's
+rectangle, so a jam reported fifty times is one block_area, not fifty.
+Incidents live in the database, so every worker sees the same set, and a
+route only avoids the incidents inside its own bounding box.
+"""
+import math
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from spatial import KM_PER_DEG_LAT
+
+TRAFFIC_TTL_MINUTES = float(os.getenv("TRAFFIC_TTL_MINUTES", "30"))
+# Half-width of the area a single report blocks (GraphHopper's old 200 m circle)
+REPORT_RADIUS_M = 200.0
+# Reports this close to an incident's rectangle extend it instead of opening a new one
+MERGE_DISTANCE_M = 300.0
+# Margin around a route's stops within which incidents are considered
+ROUTE_PAD_KM = 1.0
+# Upper bound on block_area parameters per GraphHopper request; most reported first
+MAX_ROUTE_INCIDENTS = 25
+
+def _pad(lat: float, meters: float):
+    """(dlat, dlng) in degrees for `meters` around latitude lat"""
+    dlat = meters / 1000.0 / KM_PER_DEG_LAT
+    dlng = meters / 1000.0 / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 1e-6))
+    return dlat, dlng
+
+def bounding_box(points: list, pad_km: float = ROUTE_PAD_KM):
+    """(min_lat, min_lng, max_lat, max_lng) around points, padded by pad_km"""
+    lats = [p[0] for p in points]
+    lngs = [p[1] for p in points]
+    dlat, dlng = _pad(max(abs(l) for l in lats), pad_km * 1000.0)
+    return min(lats) - dlat, min(lngs) - dlng, max(lats) + dlat, max(lngs) + dlng
+
+def _overlapping(box, now: datetime):
+    min_lat, min_lng, max_lat, max_lng = box
+    return (
+        models.TrafficIncident.expires_at > now,
+        models.TrafficIncident.min_lat <= max_lat,
+        models.TrafficIncident.max_lat >= min_lat,
+        models.TrafficIncident.min_lng <= max_lng,
+        models.TrafficIncident.max_lng >= min_lng,
+    )
+
+async def report(db: AsyncSession, lat: float, lng: float) -> models.TrafficIncident:
+    """Record a report, merging it (and any incidents it bridges) into one live incident"""
+    now = datetime.utcnow()
+    dlat, dlng = _pad(lat, REPORT_RADIUS_M)
+    mlat, mlng = _pad(lat, MERGE_DISTANCE_M)
+    result = await db.execute(select(models.TrafficIncident).filter(
+        *_overlapping((lat - mlat, lng - mlng, lat + mlat, lng + mlng), now)
+    ).order_by(models.TrafficIncident.id))
+    nearby = result.scalars().all()
+
+    if nearby:
+        incident, merged = nearby[0], nearby[1:]
+    else:
+        incident, merged = models.TrafficIncident(reports=0, min_lat=lat, min_lng=lng, max_lat=lat, max_lng=lng), []
+        db.add(incident)
+    incident.min_lat = min([incident.min_lat, lat - dlat] + [m.min_lat for m in merged])
+    incident.min_lng = min([incident.min_lng, lng - dlng] + [m.min_lng for m in merged])
+    incident.max_lat = max([incident.max_lat, lat + dlat] + [m.max_lat for m in merged])
+    incident.max_lng = max([incident.max_lng, lng + dlng] + [m.max_lng for m in merged])
+    incident.reports = incident.reports + 1 + sum(m.reports for m in merged)
+    incident.expires_at = now + timedelta(minutes=TRAFFIC_TTL_MINUTES)
+    for m in merged:
+        await db.delete(m)
+
+    # Expired incidents are never read again; drop them while we are writing anyway
+    await db.execute(delete(models.TrafficIncident).where(models.TrafficIncident.expires_at <= now))
+    await db.commit()
+    return incident
+
+async def route_areas(db: AsyncSession, points: list) -> list:
+    """Live incident rectangles (min_lat, min_lng, max_lat, max_lng) near a route's stops"""
+    if not points:
+        return []
+    result = await db.execute(
+        select(models.TrafficIncident.min_lat, models.TrafficIncident.min_lng,
+               models.TrafficIncident.max_lat, models.TrafficIncident.max_lng)
+        .filter(*_overlapping(bounding_box(points), datetime.utcnow()))
+        .order_by(models.TrafficIncident.reports.desc(), models.TrafficIncident.id)
+        .limit(MAX_ROUTE_INCIDENTS)
+    )
+    return sorted(tuple(row) for row in result.all())
+
+async def active(db: AsyncSession) -> list:
+    """All live incidents, newest first"""
+    result = await db.execute(select(models.TrafficIncident).filter(
+        models.TrafficIncident.expires_at > datetime.utcnow()
+    ).order_by(models.TrafficIncident.id.desc()))
+    return result.scalars().all()
@@ -87,8 +87,23 @@ export const getRiderOrders = async (riderId: number) => {
   return response.data;
 };
 
+// Last route per rider/options with its ETag, so polling can revalidate with If-None-Match
+const routeCache = new Map<string, { etag: string; data: any }>();
+
 export const optimizeRoute = async (riderId: number, avoidTraffic: boolean = false) => {
-  const response = await api.post(`/optimize/${riderId}?avoid_traffic=${avoidTraffic}`);
+  const url = `/optimize/${riderId}?avoid_traffic=${avoidTraffic}`;
+  const cached = routeCache.get(url);
+  const response = await api.post(url, undefined, {
+    headers: cached ? { 'If-None-Match': cached.etag } : {},
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+  });
+  if (response.status === 304 && cached) {
+    return cached.data;
+  }
+  const etag = response.headers['etag'];
+  if (etag) {
+    routeCache.set(url, { etag, data: response.data });
+  }
   return response.data;
 };
 